@@ -0,0 +1,291 @@
+"""
+Batch resolution of every exchange in a combat handler at once.
+
+resolve_combat normally rolls each exchange on its own, with scalar math
+and separate random calls. In big melees that per-exchange overhead is
+what makes the round spike, so when NumPy is available and there are
+enough pairs, we pack the inputs of every exchange into arrays and roll
+crits, damage, mitigation and bleed for all of them in one vectorized
+pass. The per-exchange results are handed back to the normal messaging
+and mutation code through TurnBatch.get_damage.
+
+Everything is read once, up front, from the turn's CombatantStates, so
+unlike the one-pair-at-a-time resolver, damage from an earlier pair
+doesn't change the health-based damage reduction of a later pair in the
+same turn.
+"""
+from game.gamesrc.combat.objects import armor
+from game.gamesrc.combat import results
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# below this many pairs, packing the arrays costs more than it saves
+BATCH_MIN_PAIRS = 8
+# crit multiplier, same as calc_round_dam
+CRIT_MULTIPLIER = 1.5
+# damage types armor can be weak or strong against
+DMG_TYPES = armor.DMG_TYPES
+
+def can_batch(parsed_pairs):
+    """
+    Whether it's worth resolving this many pairs in batch.
+    """
+    return numpy is not None and len(parsed_pairs) >= BATCH_MIN_PAIRS
+
+def roll_batch(outcomes, states, rng=None):
+    """
+    Rolls damage for both directions of every pair in one pass.
+
+    outcomes - list of (p_one, p_one_attacking, p_two, p_two_attacking,
+                winner) tuples, as made by resolve_combat
+    states - {dbref: CombatantState} for the turn
+    rng - a numpy Generator, a fresh one is used if not given
+    """
+    exchanges = []
+    for (p_one, p_one_attacking, p_two, p_two_attacking, winner) in outcomes:
+        one = states[p_one.id]
+        two = states[p_two.id]
+        exchanges.append((one, two, winner in ("both", "p_one")))
+        exchanges.append((two, one, winner in ("both", "p_two")))
+    batch = TurnBatch(exchanges)
+    batch.roll(rng or numpy.random.default_rng())
+    return batch
+
+def _round(values):
+    # python 2's round, which rounds halves away from zero
+    return numpy.sign(values) * numpy.floor(numpy.abs(values) + 0.5)
+
+def _weapon_candidates(char_state, win_type):
+    """
+    Every weapon the character could strike with this exchange, as
+    (weapon, min, max, crit_chance, dmg_type). Unarmed characters get
+    their default weapon, with a weapon of None.
+    """
+    candidates = []
+    char_weapons = char_state.usable_weapons()
+    if char_weapons:
+        weap_q_mod = char_state.stat("weap_q_mod", win_type)
+    for weapon in char_weapons:
+        dmg_bonus = weapon.damage_bonus + weap_q_mod
+        candidates.append((weapon.obj, weapon.damage[0] + dmg_bonus,
+                           weapon.damage[1] + dmg_bonus,
+                           weapon.crit_chance, weapon.dmg_type))
+    if not candidates:
+        default = char_state.default_weapon
+        candidates.append((None, default["min"], default["max"],
+                           default["crit"], default["type"]))
+    return candidates
+
+def _part_armor(vict_state, part_index, armor_q_mod):
+    """
+    Returns how much the armor over the body part takes off a hit of
+    each damage type, in armor.DMG_TYPES order and then NO_DMG_TYPE,
+    the same way calc_round_dam works it out.
+    """
+    part_armor = vict_state.armor[part_index]
+    if not part_armor:
+        return (0,) * (len(DMG_TYPES) + 1)
+    (type_id, armor_class) = part_armor
+    armor_class += armor_q_mod
+    return tuple(armor.mitigation(type_id, armor_class, dmg_id)
+                 for dmg_id in range(len(DMG_TYPES) + 1))
+
+class TurnBatch(object):
+    """
+    Holds the packed inputs and rolled results for every exchange
+    of a turn.
+
+    self.exchanges (list) - (char_state, vict_state, winner) for every
+                            exchange
+    self.results (dict) - {(char.id, vict.id): results.ExchangeResult}
+    """
+    def __init__(self, exchanges):
+        self.exchanges = exchanges
+        self.results = {}
+
+    def get_damage(self, char, vict):
+        """
+        Returns the ExchangeResult rolled for char hitting vict, given
+        either as characters or as their states.
+        """
+        return self.results[(char.id, vict.id)]
+
+    def _gather(self):
+        """
+        Reads everything the damage roll needs from every exchange
+        and packs it into arrays, padding weapon and body part candidates
+        to the widest exchange.
+        """
+        rows = []
+        for (char, vict, winner) in self.exchanges:
+            char_move = char.move
+            char_combo = char.combo
+            vict_combo = vict.combo
+            if winner:
+                win_type = "win"
+            else:
+                win_type = "lose"
+            armor_q_mod = vict.stat("armor_q_mod", "lose")
+            hit_table = vict.hit_index.table(char_move)
+            parts = [vict.body[index] for index in hit_table.indexes]
+            if char.has_script("Indomitable Willpower"):
+                health_factor = 1.0
+            else:
+                health = char.get_health_percent()
+                if 0.50 >= health >= 0.25:
+                    health_factor = 0.8
+                elif health < 0.25:
+                    health_factor = 0.6
+                else:
+                    health_factor = 1.0
+            rows.append({
+                "weapons": _weapon_candidates(char, win_type),
+                "parts": parts,
+                "hit_table": hit_table,
+                "armor": [_part_armor(vict, index, armor_q_mod)
+                          for index in hit_table.indexes],
+                "hard_range": char_combo.hard_dmg_range,
+                "crit_chance": char_combo.crit_chance,
+                "base_dmg": char.stat("dam_gain", win_type) +
+                            vict.stat("dam_vuln", "lose") +
+                            char_combo.health_vict + vict_combo.health_att +
+                            vict_combo.bleed_att + char_move.bonus_dmg,
+                "base_bleed": vict.stat("bleed_vuln", "lose") +
+                              char_combo.bleed_vict + char_move.bonus_ble,
+                "combo_multiplier": char_combo.dam_multiplier,
+                "dam_multiplier": char.stat("dam_multiplier", win_type),
+                "dam_vuln_multiplier": vict.stat("dam_vuln_multiplier",
+                                                 "lose"),
+                "combo_bleed_multiplier": char_combo.bleed_multiplier,
+                "bleed_multiplier": char.stat("bleed_multiplier", win_type),
+                "bleed_vuln_multiplier": vict.stat("bleed_vuln_multiplier",
+                                                   "lose"),
+                "no_damage": not winner or
+                    (char_move.move_type == "defensive" and
+                     not char_combo.hard_dmg_range),
+                "health_factor": health_factor})
+        return rows
+
+    def roll(self, rng):
+        """
+        Rolls every exchange in one vectorized pass and stores the
+        ExchangeResults in self.results.
+        """
+        rows = self._gather()
+        count = len(rows)
+        if not count:
+            return
+        max_weapons = max(len(row["weapons"]) for row in rows)
+        max_parts = max(max(len(row["parts"]) for row in rows), 1)
+        # weapon candidates, padded
+        w_count = numpy.zeros(count, dtype=int)
+        w_min = numpy.zeros((count, max_weapons))
+        w_max = numpy.zeros((count, max_weapons))
+        w_crit = numpy.zeros((count, max_weapons))
+        w_type = numpy.full((count, max_weapons), armor.NO_DMG_TYPE,
+                            dtype=int)
+        # body part candidates, padded
+        p_count = numpy.zeros(count, dtype=int)
+        p_weight = numpy.ones(count)
+        p_cum = numpy.full((count, max_parts), numpy.inf)
+        p_mult = numpy.ones((count, max_parts))
+        p_crit_dmg = numpy.zeros((count, max_parts))
+        p_crit_bleed = numpy.zeros((count, max_parts))
+        p_mitigation = numpy.zeros((count, max_parts, len(DMG_TYPES) + 1))
+        # everything else, one value per exchange
+        columns = ("crit_chance", "base_dmg", "base_bleed",
+                   "combo_multiplier", "dam_multiplier",
+                   "dam_vuln_multiplier", "combo_bleed_multiplier",
+                   "bleed_multiplier", "bleed_vuln_multiplier",
+                   "health_factor")
+        flat = dict((key, numpy.array([row[key] for row in rows],
+                                      dtype=float)) for key in columns)
+        no_damage = numpy.array([row["no_damage"] for row in rows])
+        has_hard = numpy.zeros(count, dtype=bool)
+        hard_min = numpy.zeros(count)
+        hard_max = numpy.zeros(count)
+        for (i, row) in enumerate(rows):
+            w_count[i] = len(row["weapons"])
+            for (j, (weapon, low, high, crit, dmg_type)) in \
+                    enumerate(row["weapons"]):
+                w_min[i, j] = low
+                w_max[i, j] = high
+                w_crit[i, j] = crit
+                w_type[i, j] = armor.DMG_TYPE_IDS.get(dmg_type,
+                                                      armor.NO_DMG_TYPE)
+            hit_table = row["hit_table"]
+            p_count[i] = len(hit_table)
+            if hit_table:
+                parts = slice(0, len(hit_table))
+                p_weight[i] = hit_table.total_weight
+                p_cum[i, parts] = hit_table.cum_weights
+                p_mult[i, parts] = hit_table.multipliers
+                p_crit_dmg[i, parts] = hit_table.crit_dmg
+                p_crit_bleed[i, parts] = hit_table.crit_bleed
+                p_mitigation[i, parts] = row["armor"]
+            if row["hard_range"]:
+                has_hard[i] = True
+                hard_min[i] = row["hard_range"]["min"]
+                hard_max[i] = row["hard_range"]["max"]
+        index = numpy.arange(count)
+        # draw all of our randomness at once
+        weapon_pick = (rng.random(count) * w_count).astype(int)
+        has_parts = p_count > 0
+        # one draw against each exchange's cumulative hit weights
+        part_roll = rng.random(count) * p_weight
+        part_pick = (p_cum <= part_roll[:, None]).sum(axis=1)
+        part_pick = numpy.minimum(part_pick, numpy.maximum(p_count - 1, 0))
+        crit_roll = rng.integers(1, 101, size=count) / 100.0
+        low = numpy.where(has_hard, hard_min, w_min[index, weapon_pick])
+        high = numpy.where(has_hard, hard_max, w_max[index, weapon_pick])
+        dmg_roll = rng.integers(low.astype(int), high.astype(int),
+                                endpoint=True)
+        # crits
+        crit = (crit_roll <= w_crit[index, weapon_pick] +
+                flat["crit_chance"]) & has_parts
+        dmg = numpy.where(crit, p_crit_dmg[index, part_pick], 0.0)
+        bleed = numpy.where(crit, p_crit_bleed[index, part_pick], 0.0)
+        # flat bonuses, the roll, then all of the multipliers
+        dmg += flat["base_dmg"] + dmg_roll
+        bleed += flat["base_bleed"]
+        dmg *= numpy.where(crit, CRIT_MULTIPLIER, 1.0)
+        dmg *= flat["combo_multiplier"]
+        for key in ("dam_multiplier", "dam_vuln_multiplier"):
+            dmg *= numpy.where(flat[key] > 0, flat[key], 1.0)
+        # location multiplier and armor mitigation
+        mitigation = p_mitigation[index, part_pick,
+                                  w_type[index, weapon_pick]]
+        mitigated = _round(dmg * p_mult[index, part_pick] - mitigation)
+        dmg = numpy.where(has_parts, mitigated, dmg)
+        # bleed multipliers only apply when damage got through
+        hurt = dmg > 0
+        for key in ("combo_bleed_multiplier", "bleed_multiplier",
+                    "bleed_vuln_multiplier"):
+            bleed += numpy.where(hurt & (flat[key] > 0),
+                                 _round(dmg * flat[key]), 0.0)
+        # losers and plain defensive moves don't do any damage
+        dmg[no_damage] = 0
+        bleed[no_damage] = 0
+        crit &= ~no_damage
+        factor = flat["health_factor"]
+        dmg = numpy.where(factor != 1.0, _round(dmg * factor), dmg)
+        # hand it all back as the ExchangeResults the resolver works with
+        for (i, (char, vict, winner)) in enumerate(self.exchanges):
+            weapon = rows[i]["weapons"][weapon_pick[i]]
+            body_part = None
+            if has_parts[i] and not no_damage[i]:
+                body_part = rows[i]["parts"][part_pick[i]]
+            crit_effect = None
+            if crit[i]:
+                crit_effect = rows[i]["hit_table"].crit_effects[part_pick[i]]
+            result = results.new_result()
+            result.weapon = weapon[0]
+            result.dmg = float(dmg[i])
+            result.dmg_type = weapon[4]
+            result.bleed = float(bleed[i])
+            result.bodypart = body_part
+            result.crit = bool(crit[i])
+            result.crit_effect = crit_effect
+            self.results[(char.id, vict.id)] = result
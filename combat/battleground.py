@@ -0,0 +1,185 @@
+"""
+Cached room graph, and the battlegrounds built from it.
+
+A fight makes the rooms around it a battleground (see
+CombatHandler.combat_state). That used to be worked out by recursing
+through exit.destination.contents for every fight, checking each room
+and exit against lists, going through rooms it could reach more than
+one way again every time, and giving up on a room's other exits as
+soon as it came to one that wasn't a cardinal direction.
+
+ROOM_GRAPH keeps every room's exits, read from its contents the first
+time they're needed, and battlegrounds are built from it breadth
+first, going through each room once. They're memoized per origin room
+and depth, so fights in the same area share them.
+
+Whenever an exit is created, deleted or moved, exit_changed has to be
+called with it, which drops the exits cached for the room it leads out
+of and every battleground built through that room. The Exit typeclass
+lives outside the combat package, so TrackedExit is here for it to mix
+in, calling exit_changed from the exit's own hooks. A cached
+battleground is also checked before it's reused, and built again if
+any of its rooms' exits has since been deleted, moved elsewhere or lost
+its destination, so an exit that doesn't take the mixin can't leave a
+stale one behind; new exits are only picked up through exit_changed.
+"""
+from collections import deque
+
+# exits a battleground carries on through; rooms reached through any
+# other exit are part of it, but it goes no further from them
+CARDINAL_EXITS = ("north", "east", "south", "west", "up", "down")
+
+class Battleground(object):
+    """
+    The rooms and exits a fight takes in.
+
+    self.rooms (list) - every room, the origin first, nearest first
+    self.exits (list) - every exit out of them that's part of it
+    self.room_ids (set) - ids of the rooms
+    """
+    def __init__(self, rooms, exits):
+        self.rooms = rooms
+        self.exits = exits
+        self.room_ids = set(room.id for room in rooms)
+
+class RoomGraph(object):
+    """
+    self.exits (dict) - {room id: exits out of the room}
+    self.battlegrounds (dict) - {(origin id, depth): Battleground}
+    self.by_room (dict) - {room id: set of (origin id, depth) keys of
+                          every battleground built through the room}
+    """
+    def __init__(self):
+        self.exits = {}
+        self.battlegrounds = {}
+        self.by_room = {}
+
+    def exits_of(self, room):
+        """
+        Returns the exits out of the room.
+        """
+        exits = self.exits.get(room.id)
+        if exits is None:
+            exits = [con for con in room.contents if con.destination]
+            self.exits[room.id] = exits
+        return exits
+
+    def build(self, origin, depth):
+        """
+        Builds the battleground of every room up to depth exits away
+        from the origin, going breadth first.
+        """
+        rooms = [origin]
+        exits = []
+        seen_rooms = set([origin.id])
+        seen_exits = set()
+        # (room, exits away from the origin)
+        queue = deque([(origin, 0)])
+        while queue:
+            (room, distance) = queue.popleft()
+            if distance >= depth:
+                continue
+            for exit in self.exits_of(room):
+                if exit.id not in seen_exits:
+                    seen_exits.add(exit.id)
+                    exits.append(exit)
+                destination = exit.destination
+                if destination.id in seen_rooms:
+                    continue
+                seen_rooms.add(destination.id)
+                rooms.append(destination)
+                # the origin's rooms are always gone on from, past them
+                # only through cardinal exits
+                if distance == 0 or exit.key in CARDINAL_EXITS:
+                    queue.append((destination, distance + 1))
+        return Battleground(rooms, exits)
+
+    def is_stale(self, room):
+        """
+        Whether any of the exits cached for the room has been deleted,
+        moved out of it or lost its destination since.
+        """
+        for exit in self.exits.get(room.id, ()):
+            location = exit.location
+            if exit.id is None or location is None or \
+                    location.id != room.id or not exit.destination:
+                return True
+        return False
+
+    def get(self, origin, depth):
+        """
+        Returns the battleground around the origin, building it the first
+        time, or again if any of its rooms' exits has gone stale.
+        """
+        key = (origin.id, depth)
+        found = self.battlegrounds.get(key)
+        if found is not None:
+            stale = [room for room in found.rooms if self.is_stale(room)]
+            for room in stale:
+                self.invalidate(room)
+            if stale:
+                found = None
+        if found is None:
+            found = self.build(origin, depth)
+            self.battlegrounds[key] = found
+            for room_id in found.room_ids:
+                self.by_room.setdefault(room_id, set()).add(key)
+        return found
+
+    def invalidate(self, room):
+        """
+        Forgets the exits out of the room, and every battleground built
+        through it.
+        """
+        self.exits.pop(room.id, None)
+        for key in self.by_room.pop(room.id, ()):
+            found = self.battlegrounds.pop(key, None)
+            if found is None:
+                continue
+            for room_id in found.room_ids:
+                keys = self.by_room.get(room_id)
+                if keys:
+                    keys.discard(key)
+
+    def clear(self):
+        """
+        Forgets everything.
+        """
+        self.exits = {}
+        self.battlegrounds = {}
+        self.by_room = {}
+
+class TrackedExit(object):
+    """
+    Mixin for the Exit typeclass, keeping ROOM_GRAPH up to date as exits
+    are created, deleted and moved.
+    """
+    def at_object_creation(self):
+        super(TrackedExit, self).at_object_creation()
+        exit_changed(self)
+
+    def at_object_delete(self):
+        exit_changed(self)
+        return super(TrackedExit, self).at_object_delete()
+
+    def at_after_move(self, source_location):
+        super(TrackedExit, self).at_after_move(source_location)
+        if source_location:
+            ROOM_GRAPH.invalidate(source_location)
+        exit_changed(self)
+
+ROOM_GRAPH = RoomGraph()
+
+def get_battleground(origin, depth):
+    """
+    See RoomGraph.get.
+    """
+    return ROOM_GRAPH.get(origin, depth)
+
+def exit_changed(exit):
+    """
+    Call when an exit is created or deleted, with the exit. Drops
+    everything cached through the room it leads out of.
+    """
+    if exit.location:
+        ROOM_GRAPH.invalidate(exit.location)
@@ -1,8 +1,43 @@
 from game.gamesrc.commands.command import MuxCommand
 from game.gamesrc.combat import move
 from game.gamesrc.combat import combo
+from game.gamesrc.combat import preview
+from game.gamesrc.combat import state
 import random
 
+# the techniques each weapon lets its wielder do, as its combo command
+# does. Subclasses (eg. battleaxes) get their parent's.
+WEAPON_COMBOS = (
+    ("game.gamesrc.combat.objects.weapons.Longsword", combo.longsword_combos),
+    ("game.gamesrc.combat.objects.weapons.Axe", combo.axe_combos),
+    ("game.gamesrc.combat.objects.weapons.Mace", combo.mace_combos),
+    ("game.gamesrc.combat.objects.weapons.Greatsword",
+     combo.greatsword_combos),
+    ("game.gamesrc.combat.objects.weapons.Stave", combo.stave_combos),
+    ("game.gamesrc.combat.objects.weapons.Dagger", combo.dagger_combos),
+    ("game.gamesrc.combat.objects.weapons.Spear", combo.spear_combos))
+SHIELD_TYPECLASS = "game.gamesrc.combat.objects.armor.Shield"
+
+def wielded_combos(caller):
+    """
+    Returns every technique the caller can do with what they're
+    wielding. A shield only counts if they have its trait, as its combo
+    command is only given to them then.
+    """
+    legal_combos = []
+    for wielding in caller.db.wielding.values():
+        if not wielding:
+            continue
+        if wielding.is_typeclass(SHIELD_TYPECLASS, exact=False):
+            if caller.scripts.get(wielding.db.trait):
+                legal_combos.extend(combo.shield_combos)
+            continue
+        for (typeclass, weapon_combos) in WEAPON_COMBOS:
+            if wielding.is_typeclass(typeclass, exact=False):
+                legal_combos.extend(weapon_combos)
+                break
+    return legal_combos
+
 class CmdFlee(MuxCommand):
     """
     Usage: flee [!]
@@ -1018,4 +1053,87 @@ class CmdStopCombat(MuxCommand):
         string += "If you are not attacking them, they will " 
         string += "automatically stop attacking you when the round resolves.\n"
         tgt.msg(string)
-        combat_handler.add_stop_request(caller, tgt)
\ No newline at end of file
+        combat_handler.add_stop_request(caller, tgt)
+
+class CmdAssess(MuxCommand):
+    """
+    Sizes up what a move, and a technique if you give one, would do
+    against whoever you're fighting: how likely it is to land against
+    anything they could do this turn, and how much damage and bleeding
+    it would cause if it does. Nothing is done to either of you.
+
+    Usage:
+        assess <move>
+        assess <move> with <technique>
+    """
+    key = "assess"
+    locks = "cmd:all()"
+    help_category = "Combat"
+
+    def func(self):
+        caller = self.caller
+        combat_handler = caller.ndb.combat_handler
+        if not combat_handler:
+            caller.msg("You're not in combat. You can't do this.")
+            return
+        if not self.args:
+            caller.msg("What move do you want to assess?")
+            return
+        args = self.args.strip().lower()
+        combo_name = None
+        if " with " in args:
+            (args, combo_name) = [arg.strip() for arg in
+                                  args.split(" with ", 1)]
+        chosen_move = None
+        for combat_move in move.CLASSIC_MATRIX:
+            if args == combat_move.name or args in combat_move.aliases:
+                chosen_move = combat_move
+                break
+        if not chosen_move:
+            caller.msg("What move did you want to assess? Invalid input.")
+            return
+        chosen_combo = None
+        if combo_name:
+            for char_combo in wielded_combos(caller):
+                if combo_name == char_combo.name:
+                    chosen_combo = char_combo
+                    break
+            if not chosen_combo:
+                caller.msg("You can't do a technique called %s with what "
+                           "you're wielding." % (combo_name))
+                return
+        tgt = combat_handler.db.pairs[caller]
+        if not tgt:
+            caller.msg("You aren't fighting anyone to assess it against.")
+            return
+        # we can't know what they're going to do, so we weigh up
+        # everything they're still allowed to do
+        prev_move = combat_handler.db.turn_actions[tgt.id]["previous_move"]
+        tgt_moves = [tgt_move for tgt_move in move.CLASSIC_MATRIX
+                     if tgt_move != prev_move]
+        # built with the combo we're assessing, so preview can use its
+        # modifiers as they are
+        chosen_combo = chosen_combo or combo.Dummy()
+        outlook = preview.preview(
+            state.CombatantState(caller, chosen_move, chosen_combo),
+            state.CombatantState(tgt, move.pass_turn, combo.Dummy()),
+            chosen_move, chosen_combo, tgt_moves,
+            combat_handler.get_pair_graph().is_attacking(tgt, caller))
+        string = "You size up %s against {M%s{n" % (chosen_move.name,
+                                                    tgt.db.sdesc)
+        if chosen_combo.name:
+            string += " with %s" % (chosen_combo.name)
+        string += ":\n"
+        string += "  Lands: %d%% (%d%% both land, %d%% they win, " % \
+            (outlook.hit_chance * 100, outlook.outcomes["both"] * 100,
+             outlook.outcomes["lose"] * 100)
+        string += "%d%% neither)\n" % (outlook.outcomes["null"] * 100)
+        (dmg_min, dmg_max) = outlook.damage_range()
+        (bleed_min, bleed_max) = outlook.bleed_range()
+        string += "  If it lands: %d-%d damage, %d-%d bleed, " % \
+            (dmg_min, dmg_max, bleed_min, bleed_max)
+        string += "%d%% chance of a critical hit\n" % \
+            (outlook.crit_chance * 100)
+        string += "  All told: %.1f damage and %.1f bleed to expect" % \
+            (outlook.expected_damage, outlook.expected_bleed)
+        caller.msg(string)
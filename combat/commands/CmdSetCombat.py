@@ -2,7 +2,7 @@ from ev import CmdSet
 from CmdCombat import CmdFlee, CmdCombatRescue, CmdCombatStrike, CmdCombatMove
 from CmdCombat import CmdStopCombat, CmdLongswordCombo, CmdAxeCombo, CmdMaceCombo
 from CmdCombat import CmdGreatswordCombo, CmdStaveCombo, CmdDaggerCombo, CmdSpearCombo
-from CmdCombat import CmdShieldCombo
+from CmdCombat import CmdShieldCombo, CmdAssess
 """
 Command sets for all of our combat commands. Each weapon gets its own combo
 command set.
@@ -17,6 +17,7 @@ class CmdSetCombat(CmdSet):
         self.add(CmdCombatStrike())
         self.add(CmdCombatMove())
         self.add(CmdStopCombat())
+        self.add(CmdAssess())
 
 class CmdSetLongsword(CmdSet):
     key = "CmdSetLongsword"
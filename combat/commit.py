@@ -0,0 +1,168 @@
+"""
+Write-behind buffer for the changes a turn makes to characters.
+
+Character.add_wound appends to db.wounds and calls set_health, and
+at_heal_tick rewrites both, so committing a turn straight to the
+characters meant several database writes per character for every wound
+and heal tick. A CombatCommit collects those changes instead, on copies
+of each character's health, wounds and positioning read the first time
+they're needed, and flush writes each field that changed once per
+character.
+
+Everything read back through the buffer (get_health, get_wounds,
+get_pos) sees the changes made to it so far. The combat handler keeps
+one for the whole of end_turn and flushes it before anyone sees their
+prompt.
+"""
+from game.gamesrc.combat import wounds
+
+# positioning limits, same as Character.set_pos
+MIN_POS = 0
+MAX_POS = 8
+
+class CommitEntry(object):
+    """
+    The buffered fields of a single character.
+
+    self.dirty (set) - names of the fields changed since the last flush
+    self.tickers (set) - ticker hooks to start/stop on flush:
+                         "start_bleed", "start_heal", "stop_heal"
+    """
+    __slots__ = ("char", "health", "max_health", "wounds", "pos", "dirty",
+                 "tickers")
+
+    def __init__(self, char):
+        self.char = char
+        self.health = char.db.health
+        self.max_health = char.db.max_health
+        # only unpickled if the turn touches them
+        self.wounds = None
+        self.pos = char.ndb.pos or 0
+        self.dirty = set()
+        self.tickers = set()
+
+    def get_wounds(self):
+        """
+        Returns the buffered wound list, reading it in on first use.
+        """
+        if self.wounds is None:
+            self.wounds = list(self.char.db.wounds or [])
+        return self.wounds
+
+class CombatCommit(object):
+    """
+    Turn-scoped buffer of health, wound and positioning changes.
+
+    self.entries (dict) - {dbref: CommitEntry}
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def entry(self, char):
+        """
+        Returns the character's CommitEntry, starting one if needed.
+        """
+        try:
+            return self.entries[char.id]
+        except KeyError:
+            entry = CommitEntry(char)
+            self.entries[char.id] = entry
+            return entry
+
+    def get_health(self, char):
+        """
+        The character's health, with the buffered changes.
+        """
+        return self.entry(char).health
+
+    def get_wounds(self, char):
+        """
+        The character's wounds, with the buffered changes.
+        """
+        return self.entry(char).get_wounds()
+
+    def get_pos(self, char):
+        """
+        The character's positioning, with the buffered changes.
+        """
+        return self.entry(char).pos
+
+    def set_health(self, char, health):
+        """
+        Buffers a new health, no higher than max health, as
+        Character.set_health.
+        """
+        entry = self.entry(char)
+        entry.health = min(health, entry.max_health)
+        entry.dirty.add("health")
+
+    def set_pos(self, char, new_pos):
+        """
+        Buffers new positioning, within its limits, as Character.set_pos.
+        """
+        entry = self.entry(char)
+        entry.pos = max(MIN_POS, min(MAX_POS, new_pos))
+        entry.dirty.add("pos")
+
+    def add_wound(self, char, location=None, damage=0, bleed=0,
+                  dmg_type=None):
+        """
+        Buffers a wound, as Character.add_wound.
+        """
+        entry = self.entry(char)
+        if damage == 0 and bleed > 0:
+            wound = wounds.BloodlossWound(bleed, char)
+        elif damage > 0:
+            wound = wounds.Wound(location, damage, bleed, dmg_type, char)
+        else:
+            return
+        entry.get_wounds().append(wound)
+        entry.dirty.add("wounds")
+        self.set_health(char, entry.health - damage)
+        if not char.ndb.combat_handler:
+            if bleed > 0:
+                entry.tickers.add("start_bleed")
+            entry.tickers.add("start_heal")
+
+    def heal_tick(self, char):
+        """
+        Buffers a heal tick, as Character.at_heal_tick.
+        """
+        entry = self.entry(char)
+        char_wounds = entry.get_wounds()
+        if not char_wounds:
+            entry.tickers.add("stop_heal")
+            return
+        healed = []
+        total_dmg = 0
+        for wound in char_wounds:
+            if not isinstance(wound, wounds.BloodlossWound):
+                wound.damage -= 3
+                if not wound.is_valid():
+                    continue
+                total_dmg += wound.damage
+            healed.append(wound)
+        entry.wounds = healed
+        entry.dirty.add("wounds")
+        self.set_health(char, entry.max_health - total_dmg)
+
+    def flush(self):
+        """
+        Writes every changed field back to its character, once each,
+        and empties the buffer.
+        """
+        for entry in self.entries.values():
+            char = entry.char
+            if "wounds" in entry.dirty:
+                char.db.wounds = entry.wounds
+            if "health" in entry.dirty:
+                char.db.health = entry.health
+            if "pos" in entry.dirty:
+                char.set_pos(entry.pos)
+            if "stop_heal" in entry.tickers:
+                char.stop_heal()
+            if "start_bleed" in entry.tickers:
+                char.start_bleed()
+            if "start_heal" in entry.tickers:
+                char.start_heal()
+        self.entries = {}
@@ -0,0 +1,214 @@
+"""
+Status effect timers driven by combat rounds, kept in memory.
+
+When a fight started, the combat handler stopped every status effect
+on each combatant and made it again with create_script, with the
+round's interval; when the fight ended it did the same the other way
+round, and every effect piled on during the fight was stopped and made
+again to stack its duration. Each of those is several database writes
+and a typeclass to set up.
+
+Status effects that take the PausableEffect mixin are paused instead
+when their character starts fighting. The handler runs a repeat of
+each of them every round (round_tick), stacks new durations onto them
+in memory (add_effect), and only when the character leaves the fight
+is the number of repeats they have left saved and their timer started
+again (end_combat). Effects that don't take the mixin are handled the
+old way.
+
+Whichever effects are paused for a character are kept on
+char.ndb.combat_effects, {effect key: script}, so nothing has to go
+through the character's scripts every round.
+
+How many repeats a paused effect has left is saved to its
+db.combat_repeats whenever it changes, one write a round, so that a
+server reload mid-fight picks up where the fight left off: when the
+handler starts again, start_combat pauses every effect that was paused
+with the repeats it had left, rather than what its own timer says.
+"""
+from ev import create_script
+
+# seconds between an effect's repeats once the fight is over
+OUT_OF_COMBAT_INTERVAL = 30
+# a status effect on its last repeat when the fight starts is dropped
+# unless there are more than this many seconds to go on it
+LAST_REPEAT_MIN_TIME = 15
+# and one is dropped when the fight ends unless it has more than one
+# repeat to go, with more than this many seconds to go on the current one
+END_REPEAT_MIN_TIME = 20
+
+class PausableEffect(object):
+    """
+    Mixin for status effect scripts, letting the combat handler freeze
+    their timer for a fight and run their repeats itself.
+
+    self.ndb.combat_repeats (int) - repeats left while paused for a fight,
+                                    None to go on until stopped
+    self.ndb.combat_paused (boolean) - whether it's paused for a fight
+    self.db.combat_repeats, self.db.combat_paused - the same, saved for
+                                                    after a reload
+    """
+    def pause_for_combat(self, repeats):
+        """
+        Stops the effect's timer, with repeats to go (None for no end).
+        """
+        self.pause()
+        self.ndb.combat_paused = True
+        self.db.combat_paused = True
+        self._set_repeats(repeats)
+
+    def _set_repeats(self, repeats):
+        self.ndb.combat_repeats = repeats
+        self.db.combat_repeats = repeats
+
+    def extend(self, repeats):
+        """
+        Stacks more repeats onto the effect, or if repeats is None, has it
+        go on until it's stopped.
+        """
+        if repeats is None:
+            self._set_repeats(None)
+        elif self.ndb.combat_repeats is not None:
+            self._set_repeats(self.ndb.combat_repeats + repeats)
+
+    def combat_tick(self):
+        """
+        Runs one of the effect's repeats for the round, and returns
+        whether it has any to go.
+        """
+        self.at_repeat()
+        if self.ndb.combat_repeats is None:
+            return True
+        self._set_repeats(self.ndb.combat_repeats - 1)
+        return self.ndb.combat_repeats > 0
+
+    def resume_after_combat(self, interval):
+        """
+        Saves how many repeats the effect has left and starts its timer
+        again, repeating every interval seconds.
+        """
+        repeats = self.ndb.combat_repeats
+        self.ndb.combat_paused = False
+        del self.db.combat_paused
+        del self.db.combat_repeats
+        if repeats is not None:
+            # remaining_repeats counts down from self.repeats, so the
+            # repeats run so far stay in the total
+            self.repeats = self.repeats - (self.remaining_repeats() or 0) + \
+                repeats
+        self.interval = interval
+        self.unpause()
+
+def _pausable(script):
+    return isinstance(script, PausableEffect)
+
+def _effects(character):
+    if character.ndb.combat_effects is None:
+        character.ndb.combat_effects = {}
+    return character.ndb.combat_effects
+
+def start_combat(character, interval):
+    """
+    Pauses the character's status effects for a fight, or for the ones
+    that can't be paused, makes them again with the round's interval.
+    Effects that were paused already, before a reload, are paused again
+    with the repeats they had left.
+    """
+    effects = _effects(character)
+    for script in character.scripts.all():
+        if not script.db.is_status_effect:
+            continue
+        if _pausable(script) and script.db.combat_paused:
+            # paused for this fight before a reload, so it goes on from
+            # the repeats it had left then
+            repeats = script.db.combat_repeats
+            if repeats is not None and repeats < 1:
+                script.stop()
+                continue
+            script.pause_for_combat(repeats)
+            effects[script.key] = script
+            continue
+        repeats = script.remaining_repeats()
+        if repeats > 1:
+            pass
+        elif script.time_until_next_repeat() > LAST_REPEAT_MIN_TIME:
+            repeats = 1
+        else:
+            script.stop()
+            continue
+        if _pausable(script):
+            script.pause_for_combat(repeats)
+            effects[script.key] = script
+        else:
+            script.stop()
+            create_script(script, obj=character, repeats=repeats,
+                          interval=interval)
+
+def round_tick(character):
+    """
+    Runs a repeat of every status effect paused on the character, and
+    stops the ones that have run out.
+    """
+    effects = _effects(character)
+    for (key, script) in list(effects.items()):
+        if not script.combat_tick():
+            del effects[key]
+            script.stop()
+
+def add_effect(character, effect, typeclass, duration, interval):
+    """
+    Puts a status effect on the character, stacking the duration onto
+    it if they already have it.
+
+    effect - the effect's key
+    typeclass - what to make the effect from, if they don't have it
+    duration - repeats it lasts, None for no end
+    """
+    effects = _effects(character)
+    if effect in effects:
+        effects[effect].extend(duration)
+        return
+    repeats = 0
+    exist = character.scripts.get(effect)
+    if exist:
+        exist = exist[0]
+        repeats = exist.remaining_repeats() or 0
+        exist.db.quiet_mode = True
+        exist.stop()
+    if duration:
+        repeats += duration
+        script = create_script(typeclass, obj=character, interval=interval,
+                               repeats=repeats)
+    else:
+        repeats = None
+        script = create_script(typeclass, obj=character, interval=interval)
+    if script and _pausable(script):
+        script.pause_for_combat(repeats)
+        effects[effect] = script
+
+def end_combat(character):
+    """
+    Saves the status effects paused on the character and starts them
+    again out of combat, or for the ones that couldn't be paused, makes
+    them again with their usual interval.
+    """
+    effects = _effects(character)
+    for script in character.scripts.all():
+        if not script.db.is_status_effect:
+            continue
+        if script.key in effects:
+            # a paused effect always has a whole repeat to go, so only
+            # the number of them left decides
+            repeats = script.ndb.combat_repeats
+            if repeats is not None and repeats > 1:
+                script.resume_after_combat(OUT_OF_COMBAT_INTERVAL)
+            else:
+                script.stop()
+            continue
+        next_repeat = script.time_until_next_repeat()
+        repeats = script.remaining_repeats()
+        script.stop()
+        if repeats > 1 and next_repeat > END_REPEAT_MIN_TIME:
+            create_script(script, obj=character, repeats=repeats,
+                          interval=OUT_OF_COMBAT_INTERVAL)
+    del character.ndb.combat_effects
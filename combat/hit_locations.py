@@ -0,0 +1,120 @@
+"""
+Precompiled hit locations per body template.
+
+Every exchange used to work out what it could hit by scanning the
+vict's whole body and checking the move against every part's
+hit_moves. Bodies are built from a handful of templates (such as
+body.human_body), so we compile each template once into a BodyIndex
+that maps every move straight to a HitTable of the parts it can hit,
+along with everything the damage roll needs from them.
+
+A character's body is unpickled from their attributes, so it's never
+the same list as the template it came from. get_index matches bodies
+to their compiled index by what's in them, and the tables hold indexes
+into the body, so the resolver always gets the character's own parts.
+
+Parts are picked with a single draw against the cumulative hit weights.
+Parts weigh 1 unless their template gives them a hit_weight, which with
+equal weights is the same pick random.choice makes from the same draw.
+"""
+import bisect
+import random
+
+class HitTable(object):
+    """
+    Every body part a move can hit, on one body template.
+
+    self.indexes (tuple) - indexes of the hittable parts in the body
+    self.multipliers (tuple) - each part's damage_multiplier
+    self.crit_dmg (tuple) - each part's crit_bonus_dmg
+    self.crit_bleed (tuple) - each part's crit_bonus_bleed
+    self.crit_effects (tuple) - each part's crit_effect
+    self.cum_weights (tuple) - running total of the parts' hit weights
+    """
+    __slots__ = ("indexes", "multipliers", "crit_dmg", "crit_bleed",
+                 "crit_effects", "cum_weights", "total_weight")
+
+    def __init__(self, body, indexes):
+        parts = [body[index] for index in indexes]
+        self.indexes = tuple(indexes)
+        self.multipliers = tuple(part.damage_multiplier for part in parts)
+        self.crit_dmg = tuple(part.crit_bonus_dmg for part in parts)
+        self.crit_bleed = tuple(part.crit_bonus_bleed for part in parts)
+        self.crit_effects = tuple(part.crit_effect for part in parts)
+        cum_weights = []
+        total = 0
+        for part in parts:
+            total += getattr(part, "hit_weight", 1)
+            cum_weights.append(total)
+        self.cum_weights = tuple(cum_weights)
+        self.total_weight = total
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def pick(self, roll):
+        """
+        Returns the position in the table picked by roll, a float
+        from 0 up to 1.
+        """
+        return bisect.bisect_right(self.cum_weights,
+                                   roll * self.total_weight)
+
+    def choose(self, rng=random):
+        """
+        Picks a part, and returns its index in the body.
+        """
+        return self.indexes[self.pick(rng.random())]
+
+EMPTY_TABLE = HitTable([], [])
+
+class BodyIndex(object):
+    """
+    The HitTables of one body template.
+
+    self.tables (dict) - {move name: HitTable}
+    """
+    __slots__ = ("tables",)
+
+    def __init__(self, body):
+        hittable = {}
+        for (index, part) in enumerate(body):
+            for hit_move in part.hit_moves:
+                indexes = hittable.setdefault(hit_move.name, [])
+                # a part listing a move twice is still only one target
+                if index not in indexes:
+                    indexes.append(index)
+        self.tables = dict((move_name, HitTable(body, indexes))
+                           for (move_name, indexes) in hittable.items())
+
+    def table(self, move):
+        """
+        Returns the HitTable of the parts the move can hit.
+        """
+        return self.tables.get(move.name, EMPTY_TABLE)
+
+# {body signature: BodyIndex}
+_indexes = {}
+
+def body_signature(body):
+    """
+    Everything about a body that goes into its BodyIndex, as a tuple.
+    """
+    return tuple((part.name,
+                  tuple(hit_move.name for hit_move in part.hit_moves),
+                  part.damage_multiplier, part.crit_bonus_dmg,
+                  part.crit_bonus_bleed, repr(part.crit_effect),
+                  getattr(part, "hit_weight", 1)) for part in body)
+
+def get_index(body):
+    """
+    Returns the BodyIndex for the body (a template, or a character's
+    db.body), compiling it the first time its template is seen.
+    """
+    signature = body_signature(body)
+    try:
+        return _indexes[signature]
+    except KeyError:
+        index = BodyIndex(body)
+        _indexes[signature] = index
+        return index
@@ -0,0 +1,179 @@
+"""
+Per-turn modifier snapshots for combatants.
+
+Status effects and traits feed their combat stats to the resolver
+through script.get_combat_stat(stat, win_cond, move, combo). Instead of
+walking char.scripts.all() for every single lookup, the combat handler
+builds one ModifierSnapshot per combatant at the start of the turn and
+the resolver reads everything it needs from that.
+
+Scripts can also carry db.eff_multiplier, which stretches or shortens
+the status effects a character inflicts or suffers:
+{effect key: {"target": "self"/"vict"/"all", "multiplier": float}}.
+Those are summed per effect into an EffectMultipliers, kept on
+char.ndb.eff_multipliers until the character's scripts change.
+"""
+
+# every stat the resolver asks status effects and traits for
+COMBAT_STATS = ("dam_gain", "dam_vuln", "dam_multiplier",
+                "dam_vuln_multiplier", "pos_gain", "pos_vuln",
+                "tech_pos_mod", "health_regen", "bleed", "bleed_vuln",
+                "bleed_multiplier", "bleed_vuln_multiplier", "weap_q_mod",
+                "armor_q_mod", "shield_q_mod")
+# every win condition a stat can be asked for
+WIN_CONDS = ("win", "lose", "null")
+
+class ModifierSnapshot(object):
+    """
+    Holds the summed value of every combat stat, for every win condition,
+    from all of a character's status effects and traits for one turn.
+
+    The snapshot is only valid for the move and combo it was built with,
+    since get_combat_stat is allowed to depend on both.
+
+    self.move (class Move) - the move the snapshot was built for
+    self.combo (class Combo) - the combo the snapshot was built for
+    self.stats (dict) - in the form of {win_cond: {stat: value}}
+    """
+    def __init__(self, char, char_move, char_combo, scripts=None):
+        self.move = char_move
+        self.combo = char_combo
+        self.stats = {}
+        for win_cond in WIN_CONDS:
+            self.stats[win_cond] = dict.fromkeys(COMBAT_STATS, 0)
+        if scripts is None:
+            scripts = char.scripts.all()
+        for script in scripts:
+            if not (script.db.is_status_effect or script.db.is_trait):
+                continue
+            for win_cond in WIN_CONDS:
+                totals = self.stats[win_cond]
+                for stat in COMBAT_STATS:
+                    totals[stat] += script.get_combat_stat(stat, win_cond,
+                                                char_move, char_combo)
+
+    def covers(self, stat, win_cond, char_move, char_combo):
+        """
+        Whether this snapshot can answer the lookup, ie. the stat is one
+        we collected and the move/combo are the ones we were built with.
+        """
+        if stat not in COMBAT_STATS or win_cond not in self.stats:
+            return False
+        return (_name(char_move) == _name(self.move) and
+                _name(char_combo) == _name(self.combo))
+
+    def get(self, stat, win_cond):
+        """
+        Returns the summed value of the stat for the given win condition.
+        """
+        return self.stats[win_cond][stat]
+
+def _name(obj):
+    # moves and combos compare by name, and either can be None
+    return getattr(obj, "name", None)
+
+def combat_stat(char, stat, win_cond, char_move, char_combo):
+    """
+    Returns the summed combat stat for the character, from their
+    snapshot if it covers the lookup, or from their scripts if not.
+    """
+    snapshot = char.ndb.modifiers
+    if snapshot and snapshot.covers(stat, win_cond, char_move, char_combo):
+        return snapshot.get(stat, win_cond)
+    stat_val = 0
+    for script in char.scripts.all():
+        if script.db.is_status_effect or script.db.is_trait:
+            stat_val += script.get_combat_stat(stat, win_cond, char_move,
+                                               char_combo)
+    return stat_val
+
+def snapshot_modifiers(characters, moves, combos):
+    """
+    Builds a ModifierSnapshot for every combatant and stores it on
+    char.ndb.modifiers for the resolver to read from. Their
+    EffectMultipliers are rebuilt from the same scan of their scripts,
+    which catches effects that have run out on their own.
+
+    characters - {dbref: character}
+    moves - {dbref: {"move": char_move, "previous_move": prev_move}}
+    combos - {dbref: char_combo}
+    """
+    for (dbref, char) in characters.items():
+        scripts = char.scripts.all()
+        char.ndb.modifiers = ModifierSnapshot(char, moves[dbref]["move"],
+                                              combos[dbref], scripts)
+        char.ndb.eff_multipliers = EffectMultipliers(scripts)
+
+def clear_modifiers(char):
+    """
+    Drops the character's snapshot so stale modifiers never leak into
+    the next turn.
+    """
+    if char.ndb.modifiers:
+        del char.ndb.modifiers
+
+class EffectMultipliers(object):
+    """
+    Every effect multiplier from a character's scripts, summed per
+    effect key.
+
+    self.self_multi (dict) - {effect: multiplier} for effects the
+                             character inflicts on themselves
+    self.vict_multi (dict) - {effect: multiplier} for effects inflicted
+                             on the character
+    """
+    __slots__ = ("self_multi", "vict_multi")
+
+    def __init__(self, scripts):
+        self.self_multi = {}
+        self.vict_multi = {}
+        for script in scripts:
+            if not script.db.eff_multiplier:
+                continue
+            for (eff, parameter) in script.db.eff_multiplier.items():
+                target = parameter["target"]
+                if target in ("self", "all"):
+                    self.self_multi[eff] = self.self_multi.get(eff, 0) + \
+                        parameter["multiplier"]
+                if target in ("vict", "all"):
+                    self.vict_multi[eff] = self.vict_multi.get(eff, 0) + \
+                        parameter["multiplier"]
+
+    def for_self(self, eff):
+        """
+        The multiplier for an effect the character inflicts on
+        themselves, 1.0 if nothing changes it.
+        """
+        return self.self_multi.get(eff, 1.0)
+
+    def for_vict(self, eff):
+        """
+        The multiplier for an effect inflicted on the character, 1.0 if
+        nothing changes it.
+        """
+        return self.vict_multi.get(eff, 1.0)
+
+def get_eff_multipliers(char):
+    """
+    Returns the character's EffectMultipliers, building them if their
+    scripts have changed since they were last built.
+    """
+    multipliers = char.ndb.eff_multipliers
+    if multipliers is None:
+        multipliers = EffectMultipliers(char.scripts.all())
+        char.ndb.eff_multipliers = multipliers
+    return multipliers
+
+def reset_eff_multipliers(char):
+    """
+    Drops the character's EffectMultipliers, for when status effects or
+    traits are added to or stopped on them.
+    """
+    char.ndb.eff_multipliers = None
+
+def effect_duration(repeats, multiplier):
+    """
+    How many repeats a status effect gets once multiplied, as it's
+    handed to the combat handler's add_status_effect.
+    """
+    return round(repeats * multiplier, 0)
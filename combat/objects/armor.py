@@ -19,6 +19,75 @@ ARMOR_TABLE = {"makeshift": {"base_ac":1,"vs_edge":0, "vs_blunt":0, "vs_pierce":
 
 WEIGHT_TABLE = {"head":2, "torso":6, "arms":2, "legs":4, "feet":1, "hands":1}
 
+# precompiled mitigation, so working out how much armor takes off a hit
+# doesn't need any string keys. Armor types and damage types get ids, and
+# MITIGATION[armor type id][armor class][damage type id] is the armor
+# class, capped at base_ac + 3, minus the armor's vs_<damage type> mod.
+# Damage types armor has no mod against use NO_DMG_TYPE.
+ARMOR_TYPES = tuple(sorted(ARMOR_TABLE.keys()))
+ARMOR_TYPE_IDS = dict((armor_type, type_id) for (type_id, armor_type) in enumerate(ARMOR_TYPES))
+DMG_TYPES = ("edge", "blunt", "pierce")
+DMG_TYPE_IDS = dict((dmg_type, dmg_id) for (dmg_id, dmg_type) in enumerate(DMG_TYPES))
+NO_DMG_TYPE = len(DMG_TYPES)
+MAX_AC = max(ARMOR_TABLE[armor_type]["base_ac"] for armor_type in ARMOR_TYPES) + 3
+AC_CAPS = tuple(ARMOR_TABLE[armor_type]["base_ac"] + 3 for armor_type in ARMOR_TYPES)
+VS_MODS = tuple(tuple(ARMOR_TABLE[armor_type]["vs_%s" % dmg_type] for dmg_type in DMG_TYPES) + (0,)
+			for armor_type in ARMOR_TYPES)
+MITIGATION = tuple(tuple(tuple(min(armor_class, AC_CAPS[type_id]) - vs_mod for vs_mod in VS_MODS[type_id])
+			for armor_class in range(MAX_AC + 1)) for type_id in range(len(ARMOR_TYPES)))
+
+def mitigation(type_id, armor_class, dmg_type_id):
+	"""
+	How much armor of the type and (uncapped) armor class takes off a hit
+	of the damage type.
+	"""
+	if armor_class > MAX_AC:
+		armor_class = MAX_AC
+	elif armor_class < 0:
+		# status effects can push it under anything in the table
+		return armor_class - VS_MODS[type_id][dmg_type_id]
+	return MITIGATION[type_id][int(armor_class)][dmg_type_id]
+
+def build_mitigation(char):
+	"""
+	Builds the character's mitigation vector: for each part of their body,
+	in order, the (armor type id, armor class) of the armor worn over it,
+	or None. The armor class is the armor's, plus its quality bonus, before
+	status effects and the cap.
+	"""
+	vector = []
+	equipped = char.db.equipped
+	for part in char.db.body:
+		try:
+			char_armor = equipped[part.name]["armor"]
+		except (KeyError, TypeError):
+			char_armor = None
+		if not char_armor or char_armor.db.armor_type not in ARMOR_TYPE_IDS:
+			vector.append(None)
+			continue
+		vector.append((ARMOR_TYPE_IDS[char_armor.db.armor_type],
+			char_armor.db.armor_class + char_armor.db.quality - 1))
+	return tuple(vector)
+
+def get_mitigation(char, body=None):
+	"""
+	Returns the character's mitigation vector, which is only rebuilt after
+	armor is worn or removed (see reset_mitigation), or if it doesn't fit
+	the body given.
+	"""
+	vector = char.ndb.armor_mitigation
+	if vector is None or (body is not None and len(vector) != len(body)):
+		vector = build_mitigation(char)
+		char.ndb.armor_mitigation = vector
+	return vector
+
+def reset_mitigation(char):
+	"""
+	Drops the character's mitigation vector, to be rebuilt the next time
+	it's needed.
+	"""
+	char.ndb.armor_mitigation = None
+
 class Armor(Object):
 	"""
 	Armor objects that can be worn in-game over a wear location to provide protection.
@@ -57,10 +126,14 @@ class Armor(Object):
 		super(Armor, self).at_object_creation()
 		
 	def at_wear(self, caller):
+		reset_mitigation(caller)
 		# hook on scripts
 		for effect in self.db.status_effects:
 			caller.scripts.add(effect)
-	def at_remove(self):
+	def at_remove(self, caller=None):
+		if not caller:
+			caller = self.location
+		reset_mitigation(caller)
 		# hook on scripts
 		for effect in self.db.status_effects:
 			caller.scripts.stop(effect)
@@ -0,0 +1,138 @@
+"""
+Precomputed exchange outcomes.
+
+Who wins an exchange only depends on the two moves, whether either side
+used a feint (or any combo at all), and whether each side is actually
+attacking the other. That's a small enough space that we compile every
+outcome once, at import, into a flat table, so determining an outcome is
+a single indexed read. The same-combo positional tie-break depends on
+live positioning, so resolve_combat.determine_outcome applies it after
+the lookup.
+
+tests/test_outcome.py checks this table exhaustively against the
+original rules in resolve_combat.scan_outcome.
+"""
+from game.gamesrc.combat import move
+
+# every move the table knows about
+MOVES = tuple(move.CLASSIC_MATRIX) + (move.pass_turn,)
+MOVE_INDEX = dict((table_move.name, index)
+                  for (index, table_move) in enumerate(MOVES))
+MOVE_COUNT = len(MOVES)
+# combo states: no combo at all, a combo that isn't a feint, a feint
+NO_COMBO = 0
+COMBO = 1
+FEINT = 2
+COMBO_STATES = (NO_COMBO, COMBO, FEINT)
+
+# Feint reverses a failed attack vs. defense, so the feinter wins instead.
+# If it's attack vs. attack, only the non-feinter wins, and if both
+# players feinted, nobody does. A winning offensive feint is a null.
+# In the form of (feinter, win_type, lose_type, winner, new_winner),
+# checked in order, and only the first matching rule applies.
+FEINT_RULES = (
+    ("both", None, None, "both", "null"),
+    ("p_two", "defensive", "offensive", "p_one", "p_two"),
+    ("p_one", "offensive", "offensive", "p_one", "null"),
+    ("p_two", "offensive", "offensive", "p_two", "null"),
+    ("p_one", "defensive", "offensive", "p_two", "p_one"),
+    ("p_one", "offensive", "defensive", "p_one", "null"),
+    ("p_two", "offensive", "defensive", "p_two", "null"),
+    ("p_one", None, None, "both", "p_two"),
+    ("p_two", None, None, "both", "p_one"))
+
+def combo_state(char_combo):
+    """
+    Returns which of COMBO_STATES the combo counts as.
+    """
+    if char_combo is None:
+        return NO_COMBO
+    if char_combo.name == "feint":
+        return FEINT
+    return COMBO
+
+def table_index(move_one, move_two, state_one, state_two,
+                p_one_attacking, p_two_attacking):
+    """
+    Returns the position of the outcome in OUTCOME_TABLE.
+    """
+    index = MOVE_INDEX[move_one.name] * MOVE_COUNT + \
+        MOVE_INDEX[move_two.name]
+    index = (index * 3 + state_one) * 3 + state_two
+    return (index * 2 + bool(p_one_attacking)) * 2 + bool(p_two_attacking)
+
+def _base_outcome(move_one, move_two):
+    # who wins on the moves alone
+    if move_two in move_one.win_list and move_one in move_two.win_list:
+        return "both"
+    elif move_one in move_two.win_list:
+        return "p_two"
+    elif move_two in move_one.win_list:
+        return "p_one"
+    return "null"
+
+def _apply_feints(winner, move_one, move_two, state_one, state_two):
+    # feints only count if both sides actually had a combo
+    if winner == "null" or NO_COMBO in (state_one, state_two):
+        return winner
+    if winner == "p_two":
+        (win_type, lose_type) = (move_two.move_type, move_one.move_type)
+    else:
+        (win_type, lose_type) = (move_one.move_type, move_two.move_type)
+    feinters = []
+    if state_one == FEINT:
+        feinters.append("p_one")
+    if state_two == FEINT:
+        feinters.append("p_two")
+    if len(feinters) == 2:
+        feinters.append("both")
+    for (feinter, rule_win, rule_lose, rule_winner, new_winner) in \
+            FEINT_RULES:
+        if feinter in feinters and winner == rule_winner and \
+                rule_win in (None, win_type) and \
+                rule_lose in (None, lose_type):
+            return new_winner
+    return winner
+
+def compile_outcome_table():
+    """
+    Works out the outcome of every combination of moves, combo states,
+    and attacking flags, and returns them as a flat list.
+    """
+    table = [None] * (MOVE_COUNT * MOVE_COUNT * 3 * 3 * 2 * 2)
+    for move_one in MOVES:
+        for move_two in MOVES:
+            base = _base_outcome(move_one, move_two)
+            for state_one in COMBO_STATES:
+                for state_two in COMBO_STATES:
+                    feinted = _apply_feints(base, move_one, move_two,
+                                            state_one, state_two)
+                    for p_one_attacking in (False, True):
+                        for p_two_attacking in (False, True):
+                            winner = feinted
+                            # you can't win an exchange you aren't
+                            # attacking in
+                            if winner == "p_one" and not p_one_attacking:
+                                winner = "null"
+                            if winner == "p_two" and not p_two_attacking:
+                                winner = "null"
+                            table[table_index(move_one, move_two,
+                                state_one, state_two, p_one_attacking,
+                                p_two_attacking)] = winner
+    return table
+
+OUTCOME_TABLE = compile_outcome_table()
+
+def lookup_outcome(move_one, combo_one, p_one_attacking,
+                   move_two, combo_two, p_two_attacking):
+    """
+    Returns the outcome of the exchange before the same-combo tie-break,
+    or None if either move isn't in the table.
+    """
+    if move_one is None or move_two is None or \
+            move_one.name not in MOVE_INDEX or \
+            move_two.name not in MOVE_INDEX:
+        return None
+    return OUTCOME_TABLE[table_index(move_one, move_two,
+        combo_state(combo_one), combo_state(combo_two),
+        p_one_attacking, p_two_attacking)]
@@ -0,0 +1,112 @@
+"""
+Incrementally maintained index of who is fighting whom.
+
+The combat handler's db.pairs holds {attacker: victim}. Turning that
+into a list of exchanges every turn (the old pairify) meant sorting and
+list-membership checks over every pair. PairGraph instead mirrors
+db.pairs as it changes, keyed by character id, and keeps:
+
+* the set of exchanges, each keyed by its (lower id, higher id) pair
+* a reverse index of who is attacking each character
+
+so resolve_combat can walk the exchanges directly.
+"""
+from collections import OrderedDict
+
+def exchange_key(char1, char2):
+    """
+    Returns the canonical key for the exchange between two characters,
+    which is the same whichever of them is attacking.
+    """
+    if char1.id < char2.id:
+        return (char1.id, char2.id)
+    return (char2.id, char1.id)
+
+class PairGraph(object):
+    """
+    self.chars (dict) - {char.id: char} for everyone in an exchange
+    self.targets (dict) - {attacker.id: victim.id}
+    self.attackers (dict) - {victim.id: set of attacker.ids}
+    self.exchanges (OrderedDict) - {(low id, high id): count}, where count
+                                is how many of the two attack the other
+    """
+    def __init__(self):
+        self.chars = {}
+        self.targets = {}
+        self.attackers = {}
+        self.exchanges = OrderedDict()
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Builds a graph from a {attacker: victim} dict, such as db.pairs.
+        """
+        graph = cls()
+        for (attacker, victim) in pairs.items():
+            graph.set_target(attacker, victim)
+        return graph
+
+    def set_target(self, attacker, victim):
+        """
+        Makes the attacker attack the victim, dropping whoever they
+        were attacking before.
+        """
+        self.drop_target(attacker)
+        self.chars[attacker.id] = attacker
+        self.chars[victim.id] = victim
+        self.targets[attacker.id] = victim.id
+        self.attackers.setdefault(victim.id, set()).add(attacker.id)
+        key = exchange_key(attacker, victim)
+        self.exchanges[key] = self.exchanges.get(key, 0) + 1
+
+    def drop_target(self, attacker):
+        """
+        Stops the attacker from attacking anyone.
+        """
+        victim_id = self.targets.pop(attacker.id, None)
+        if victim_id is None:
+            return
+        self.attackers[victim_id].discard(attacker.id)
+        if not self.attackers[victim_id]:
+            del self.attackers[victim_id]
+        key = exchange_key(attacker, self.chars[victim_id])
+        self.exchanges[key] -= 1
+        if not self.exchanges[key]:
+            del self.exchanges[key]
+        self._forget(attacker.id)
+        self._forget(victim_id)
+
+    def _forget(self, dbref):
+        # drop the character reference once they're in no exchanges
+        if dbref not in self.targets and dbref not in self.attackers:
+            self.chars.pop(dbref, None)
+
+    def target_of(self, char):
+        """
+        Returns who the character is attacking, or None.
+        """
+        victim_id = self.targets.get(char.id)
+        if victim_id is None:
+            return None
+        return self.chars[victim_id]
+
+    def attackers_of(self, char):
+        """
+        Returns a list of everyone attacking the character.
+        """
+        return [self.chars[dbref]
+                for dbref in self.attackers.get(char.id, ())]
+
+    def is_attacking(self, attacker, victim):
+        """
+        Whether the attacker is attacking the victim.
+        """
+        return self.targets.get(attacker.id) == victim.id
+
+    def pairs(self):
+        """
+        Returns every exchange as a (p_one, p_two) tuple, with p_one
+        always being the character with the lower id.
+        """
+        chars = self.chars
+        return [(chars[low], chars[high]) for (low, high) in self.exchanges]
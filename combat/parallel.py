@@ -0,0 +1,277 @@
+"""
+Process pool resolution of independent fight clusters.
+
+Every combat handler resolves its turn on the main thread, so with a lot
+of fights going at once, the damage rolls of every exchange hold up the
+whole game at round boundaries. With the pool turned on (POOL_WORKERS
+above 0) and enough pairs in the rounds the round scheduler runs
+together, every handler's turn has its exchanges split into clusters of
+characters that only fight each other, and the damage rolls of every
+cluster of every handler go into one PoolBatch. Once every handler has
+put its clusters in, the batch ships them off to a shared
+ProcessPoolExecutor as a few chunks of about the same number of pairs,
+one per worker, so hundreds of duels are rolled across every core
+rather than one handler after another. The rolled results come back to
+the main thread, where messaging and every change to the characters
+happen as usual, through PooledTurn.get_damage.
+
+Workers only ever see detached CombatantStates (see
+CombatantState.detach), which carry no typeclasses, so nothing in a
+worker touches the database. That's also why only the damage rolls go
+to them: everything else an exchange does goes through the characters.
+Like the batch resolver, damage is rolled for the whole turn up front.
+"""
+from ev import logger
+from game.gamesrc.combat import rng as combat_rng
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+# number of worker processes, 0 turns the pool off
+POOL_WORKERS = 0
+# fewer pairs than this in every round run together and we don't bother
+# with the pool at all
+POOL_MIN_PAIRS = 16
+# chunks sent to a worker have at least this many pairs in them, unless
+# there aren't that many in the whole batch
+CHUNK_MIN_PAIRS = 4
+# how long to wait on a worker before rolling its chunk ourselves
+POOL_TIMEOUT = 5
+
+_executor = None
+
+def get_executor():
+    """
+    Returns the shared executor, starting it up on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = futures.ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _executor
+
+def shutdown():
+    """
+    Stops the shared executor, if it's running.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def can_pool(pair_count):
+    """
+    Whether rounds with pair_count pairs between them are worth handing
+    to the process pool.
+    """
+    return futures is not None and POOL_WORKERS > 0 and \
+        pair_count >= POOL_MIN_PAIRS
+
+def find_clusters(outcomes):
+    """
+    Splits the outcomes into clusters of pairs that share nobody, as a
+    list of lists of outcomes.
+    """
+    parent = {}
+    def find(dbref):
+        while parent.setdefault(dbref, dbref) != dbref:
+            parent[dbref] = parent[parent[dbref]]
+            dbref = parent[dbref]
+        return dbref
+    for (p_one, p_one_attacking, p_two, p_two_attacking, winner) in outcomes:
+        parent[find(p_one.id)] = find(p_two.id)
+    clusters = {}
+    for pair_outcome in outcomes:
+        clusters.setdefault(find(pair_outcome[0].id), []).append(pair_outcome)
+    return list(clusters.values())
+
+def _cluster_exchanges(cluster, states, detached=False):
+    # both directions of every pair, as (char_state, vict_state, winner)
+    if detached:
+        members = set()
+        for pair_outcome in cluster:
+            members.update((pair_outcome[0].id, pair_outcome[2].id))
+        states = dict((dbref, states[dbref].detach()) for dbref in members)
+    exchanges = []
+    for (p_one, p_one_attacking, p_two, p_two_attacking, winner) in cluster:
+        one = states[p_one.id]
+        two = states[p_two.id]
+        exchanges.append((one, two, winner in ("both", "p_one")))
+        exchanges.append((two, one, winner in ("both", "p_two")))
+    return exchanges
+
+def roll_cluster(roll, exchanges, seed):
+    """
+    Rolls damage for every exchange of a cluster with roll (which is
+    resolve_combat.roll_round_dam), from a CombatRNG stream of its own
+    seeded with seed, and returns it in a form that can be sent back
+    from another process:
+
+    (char.id, vict.id, weapon index, body part index, result)
+
+    where the indexes are into the char's weapons and the vict's body,
+    or None, and the ExchangeResult has its weapon and bodypart taken
+    out.
+    """
+    rng = combat_rng.CombatRNG.for_turn(seed)
+    results = []
+    for (char_state, vict_state, winner) in exchanges:
+        result = roll(char_state, vict_state, winner, rng)
+        weapon = result.weapon
+        body_part = result.bodypart
+        result.weapon = None
+        result.bodypart = None
+        weapon_index = None
+        if weapon is not None:
+            weapon_index = char_state.weapon_index(weapon)
+        part_index = None
+        if body_part is not None:
+            part_index = vict_state.body.index(body_part)
+        results.append((char_state.id, vict_state.id, weapon_index,
+                        part_index, result))
+    return results
+
+def roll_clusters(roll, jobs):
+    """
+    Rolls damage for a chunk of clusters, given as (exchanges, seed)
+    tuples, and returns what roll_cluster returns for each of them.
+    """
+    return [roll_cluster(roll, exchanges, seed)
+            for (exchanges, seed) in jobs]
+
+def roll_pooled(outcomes, states, roll, rng, inline=False, pool_batch=None):
+    """
+    Rolls damage for both directions of every pair, and returns a
+    PooledTurn.
+
+    outcomes - list of (p_one, p_one_attacking, p_two, p_two_attacking,
+                winner) tuples, as made by resolve_combat
+    states - {dbref: CombatantState} for the turn
+    roll - resolve_combat.roll_round_dam
+    rng - the turn's CombatRNG, which seeds every cluster's stream
+    inline - roll every cluster here, such as when replaying the turn;
+             each cluster's rolls only depend on its seed, so they come
+             out the same wherever they're rolled
+    pool_batch - the PoolBatch the clusters go into, to be rolled
+                 along with every other handler's; the PooledTurn only
+                 has its results once the batch has been waited on. If
+                 it isn't given, the turn gets a batch of its own.
+    """
+    turn = PooledTurn(states)
+    if inline:
+        for cluster in find_clusters(outcomes):
+            turn.merge(roll_cluster(roll,
+                _cluster_exchanges(cluster, states), rng.derive_seed()))
+        return turn
+    own_batch = pool_batch is None
+    if own_batch:
+        pool_batch = PoolBatch(roll)
+    for cluster in find_clusters(outcomes):
+        pool_batch.add(turn, len(cluster),
+            _cluster_exchanges(cluster, states, True), rng.derive_seed())
+    if own_batch:
+        pool_batch.wait()
+    return turn
+
+class PoolBatch(object):
+    """
+    The clusters of every turn being rolled in the pool together.
+
+    self.jobs (list) - (turn, pairs, exchanges, seed) of every cluster,
+                       where turn is the PooledTurn it's merged into
+    """
+    def __init__(self, roll):
+        self.roll = roll
+        self.jobs = []
+
+    def add(self, turn, pairs, exchanges, seed):
+        """
+        Queues up a cluster of pairs pairs to be rolled for turn.
+        """
+        self.jobs.append((turn, pairs, exchanges, seed))
+
+    def chunks(self):
+        """
+        Splits the jobs into about POOL_WORKERS lists of about the same
+        number of pairs, each with at least CHUNK_MIN_PAIRS pairs.
+        """
+        total = sum(job[1] for job in self.jobs)
+        count = max(1, min(POOL_WORKERS, total // CHUNK_MIN_PAIRS))
+        target = float(total) / count
+        chunks = []
+        chunk = []
+        pairs = 0
+        for job in self.jobs:
+            chunk.append(job)
+            pairs += job[1]
+            if pairs >= target * (len(chunks) + 1):
+                chunks.append(chunk)
+                chunk = []
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def wait(self):
+        """
+        Ships every chunk off to the pool, then merges what comes back
+        into its turn. A chunk that can't be sent, or whose worker fails
+        or takes too long, is rolled here.
+        """
+        pending = []
+        for chunk in self.chunks():
+            jobs = [(exchanges, seed)
+                    for (turn, pairs, exchanges, seed) in chunk]
+            try:
+                future = get_executor().submit(roll_clusters, self.roll,
+                                               jobs)
+            except Exception as err:
+                logger.log_errmsg("Combat pool submit failed: %s" % err)
+                future = None
+            pending.append((future, chunk, jobs))
+        for (future, chunk, jobs) in pending:
+            try:
+                rolled = future.result(POOL_TIMEOUT)
+            except Exception as err:
+                # a dead or stuck worker shouldn't stall the fight, roll
+                # it here
+                if future:
+                    logger.log_errmsg("Combat pool chunk failed: %s" % err)
+                rolled = roll_clusters(self.roll, jobs)
+            for (job, cluster_rolled) in zip(chunk, rolled):
+                job[0].merge(cluster_rolled)
+        self.jobs = []
+
+class PooledTurn(object):
+    """
+    Holds the damage rolled for every exchange of a turn resolved with
+    the pool, with the same get_damage as batch.TurnBatch.
+
+    self.results (dict) - {(char.id, vict.id): results.ExchangeResult}
+    """
+    def __init__(self, states):
+        self.states = states
+        self.results = {}
+
+    def merge(self, rolled):
+        """
+        Takes the results of roll_cluster and puts the real weapons and
+        body parts back into their ExchangeResults.
+        """
+        for (char_id, vict_id, weapon_index, part_index, result) in \
+                rolled:
+            weapon = None
+            if weapon_index is not None:
+                weapon = self.states[char_id].weapons[weapon_index].obj
+            body_part = None
+            if part_index is not None:
+                body_part = self.states[vict_id].body[part_index]
+            result.weapon = weapon
+            result.bodypart = body_part
+            self.results[(char_id, vict_id)] = result
+
+    def get_damage(self, char, vict):
+        """
+        Returns the ExchangeResult rolled for char hitting vict, given
+        either as characters or as their states.
+        """
+        return self.results[(char.id, vict.id)]
@@ -0,0 +1,214 @@
+"""
+Table-driven positioning rules.
+
+calc_round_pos used to be a branch per winner string, each looking up
+combo costs and tech_pos_mod again, and going through every weapon's
+pos_mods for every exchange. Here the outcome of an exchange picks a
+role for each side of the pair out of OUTCOME_ROLES, and ROLE_RULES
+says what each role's positioning is made of. Everything about a
+combatant that doesn't change over the turn (their shield's bonus,
+which weapons they have the trait for, their best pos_mod for each
+move) is worked out once, the first time they're in an exchange, and
+kept on their state as PositionInputs.
+
+evaluate works out a pair's positioning in one pass, as a
+results.PositionResult, and apply queues it up on their states.
+"""
+from game.gamesrc.combat import results
+
+# base move type positional gains for winning the round
+OFFENSIVE_POS_GAIN = 1
+DEFENSIVE_POS_GAIN = 2
+# no trait penalty
+NO_TRAIT_PENALTY = 1
+# most a shield can add to a parry
+MAX_SHIELD_BONUS = 3
+PARRIES = ("high parry", "low parry")
+
+# {winner: (p_one's role, p_two's role)}
+OUTCOME_ROLES = {"both": ("both", "both"),
+                 "null": ("null", "null"),
+                 "p_one": ("win", "lose"),
+                 "p_two": ("lose", "win")}
+
+# {role: (tech_pos_mod win condition,
+#         ((stat, win condition) added to their positioning, ...))}
+ROLE_RULES = {"both": ("win", (("pos_gain", "win"), ("pos_vuln", "win"))),
+              "null": ("lose", (("pos_gain", "null"),)),
+              "win": ("win", ()),
+              "lose": ("lose", (("pos_gain", "lose"), ("pos_vuln", "lose")))}
+
+class PositionInputs(object):
+    """
+    Everything about a combatant's positioning that holds for the whole
+    turn.
+
+    self.traits (dict) - {weapon or shield object: whether they have its
+                         trait}
+    self.shield_quality (int) - quality of their shield if they have its
+                                trait, or None
+    self.all_mod (int) - best pos_mod of their weapons for any move, or
+                         None
+    self.move_mods (dict) - {move name: best pos_mod for that move}
+    """
+    __slots__ = ("traits", "shield_quality", "all_mod", "move_mods")
+
+    def __init__(self, char_state):
+        self.traits = {}
+        self.all_mod = None
+        self.move_mods = {}
+        for weapon in char_state.weapons:
+            self.traits[weapon.obj] = char_state.has_trait(weapon)
+            for (val, cond_move) in weapon.pos_mods.items():
+                if cond_move == "all":
+                    if self.all_mod is None or val > self.all_mod:
+                        self.all_mod = val
+                    continue
+                for mod_move in cond_move:
+                    best = self.move_mods.get(mod_move.name)
+                    if best is None or val > best:
+                        self.move_mods[mod_move.name] = val
+        self.shield_quality = None
+        shield = char_state.shield
+        if shield:
+            self.traits[shield.obj] = char_state.has_trait(shield)
+            if self.traits[shield.obj]:
+                self.shield_quality = shield.quality
+
+    def has_trait(self, weapon):
+        """
+        Whether they have the trait of the weapon object, None being
+        their bare hands.
+        """
+        return self.traits.get(weapon, False)
+
+    def pos_mod(self, char_move):
+        """
+        Their best weapon pos_mod for the move, or None if none apply.
+        """
+        move_mod = self.move_mods.get(char_move.name)
+        if move_mod is None:
+            return self.all_mod
+        if self.all_mod is None:
+            return move_mod
+        return max(move_mod, self.all_mod)
+
+def get_inputs(char_state):
+    """
+    Returns the combatant's PositionInputs, working them out the first
+    time.
+    """
+    inputs = char_state.pos_inputs
+    if inputs is None:
+        inputs = PositionInputs(char_state)
+        char_state.pos_inputs = inputs
+    return inputs
+
+def _crit_pos(result):
+    # what the other side's crit gives us
+    if result and result.crit and result.bodypart:
+        return result.bodypart.crit_bonus_pos
+    return 0
+
+def _gains(char_state, role):
+    gain = 0
+    for (stat, win_cond) in ROLE_RULES[role][1]:
+        gain += char_state.stat(stat, win_cond)
+    return gain
+
+def _both_pos(own, other, weapon, other_result):
+    # both won, so both get their bonuses, and the other's crit
+    pos = own.move.bonus_pos + own.combo.pos_att + other.combo.pos_vict
+    pos += _gains(own, "both")
+    pos += _crit_pos(other_result)
+    if get_inputs(own).has_trait(weapon):
+        pos += OFFENSIVE_POS_GAIN
+    if own.combo.no_pos:
+        return 0
+    return pos
+
+def _win_pos(own, other, weapon, rng):
+    # returns (positioning, weapon broken or "fail" or None)
+    inputs = get_inputs(own)
+    own_move = own.move
+    trait = inputs.has_trait(weapon)
+    if own_move.move_type == "offensive":
+        pos = OFFENSIVE_POS_GAIN
+    else:
+        shield_bonus = 0
+        if inputs.shield_quality is not None and own.shield and \
+                own_move.name in PARRIES:
+            shield_bonus = min(inputs.shield_quality +
+                               other.stat("shield_q_mod", "lose") - 1,
+                               MAX_SHIELD_BONUS)
+        pos = DEFENSIVE_POS_GAIN + shield_bonus
+    if not trait:
+        pos -= NO_TRAIT_PENALTY
+    pos += own_move.bonus_pos + own.combo.pos_att
+    pos_mod = inputs.pos_mod(own_move)
+    if pos_mod is not None:
+        pos += pos_mod
+    # resolve_combat imports us, so we can only import it once we're loaded
+    from game.gamesrc.combat import resolve_combat
+    broken = resolve_combat.check_break(other, own, rng)
+    if broken == "fail":
+        pos = 0
+    elif broken:
+        broken.break_weapon()
+    if own.combo.no_pos:
+        pos = 0
+    return (pos, broken)
+
+def _lose_pos(own, other, other_result):
+    # the winner's combo and crit, and our own losing modifiers
+    pos = other.combo.pos_vict + _gains(own, "lose")
+    if other_result.crit:
+        pos += other_result.bodypart.crit_bonus_pos
+    return pos
+
+def evaluate(state1, state2, weapon1, weapon2, result1, result2, winner,
+             rng):
+    """
+    Works out the positioning of a pair after an exchange, without
+    setting it.
+
+    weapon1, weapon2 - what each of them hit with (weapon objects, None
+                       for bare hands or when they didn't hit)
+    result1, result2 - their results.ExchangeResults, None for the
+                       loser of the exchange
+    winner - "p_one", "p_two", "both" or "null"
+
+    Returns a results.PositionResult.
+    """
+    (role1, role2) = OUTCOME_ROLES[winner]
+    broken = None
+    if role1 == "both":
+        pos1 = _both_pos(state1, state2, weapon1, result2)
+        pos2 = _both_pos(state2, state1, weapon2, result1)
+    elif role1 == "null":
+        pos1 = _gains(state1, "null")
+        pos2 = _gains(state2, "null")
+    elif role1 == "win":
+        pos2 = _lose_pos(state2, state1, result1)
+        (pos1, broken) = _win_pos(state1, state2, weapon1, rng)
+    else:
+        pos1 = _lose_pos(state1, state2, result2)
+        (pos2, broken) = _win_pos(state2, state1, weapon2, rng)
+    # any status effects that enforce no positioning for the turn
+    if state1.no_position:
+        pos1 = 0
+    if state2.no_position:
+        pos2 = 0
+    cost1 = state1.combo.pos_cost + \
+        state1.stat("tech_pos_mod", ROLE_RULES[role1][0])
+    cost2 = state2.combo.pos_cost + \
+        state2.stat("tech_pos_mod", ROLE_RULES[role2][0])
+    return results.PositionResult(pos1, pos2, cost1, cost2, broken)
+
+def apply(position, state1, state2):
+    """
+    Queues a pair's PositionResult up on their states, to be set when
+    they're settled.
+    """
+    state1.shift_pos(position.pos_one - position.cost_one)
+    state2.shift_pos(position.pos_two - position.cost_two)
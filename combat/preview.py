@@ -0,0 +1,253 @@
+"""
+Expected outcomes of a move and combo, without resolving anything.
+
+preview answers "what happens if I do this to them?" without touching
+either combatant: the chance of each outcome against every move the
+defender could pick, and the exact damage, bleed and crit distribution
+of the move landing.
+
+The damage distribution isn't sampled. Every weapon the attacker could
+strike with, every body part the move can hit, crit or no crit and
+every value of the damage roll is a discrete distribution of its own,
+and we run resolve_combat.roll_round_dam once for each combination of
+them with a ScriptedRNG that makes exactly those draws, weighting the
+result by how likely the combination is. Since it's the resolver's own
+damage roll, the preview can't drift away from what actually happens.
+
+Previews are memoized in PREVIEW_CACHE by a fingerprint of everything
+they depend on: the moves and combos, both sides' equipment, the stats
+their status effects and traits give them, and the attacker's health
+band.
+"""
+from game.gamesrc.combat import move
+from game.gamesrc.combat import render
+from game.gamesrc.combat import resolve_combat
+
+# how many previews to keep
+PREVIEW_CACHE_SIZE = 512
+PREVIEW_CACHE = render.FragmentCache(PREVIEW_CACHE_SIZE)
+# the stats the damage roll asks the attacker and defender for
+ATTACKER_STATS = ("dam_gain", "weap_q_mod", "dam_multiplier",
+                  "bleed_multiplier")
+DEFENDER_STATS = ("dam_vuln", "bleed_vuln", "dam_vuln_multiplier",
+                  "bleed_vuln_multiplier", "armor_q_mod")
+# attacker's view of each outcome
+OUTCOME_NAMES = {"p_one": "win", "p_two": "lose", "both": "both",
+                 "null": "null"}
+
+class ScriptedRNG(object):
+    """
+    Stands in for the turn's rng in roll_round_dam, making the draws
+    we want to see the damage of, in the order roll_round_dam makes
+    them: the weapon (choice), the body part (random), the crit roll
+    and then the damage roll (randint). The ranges randint is asked for
+    are kept in self.ranges.
+    """
+    def __init__(self, weapon=0, part_roll=0.0, crit_roll=100,
+                 dmg_roll=None):
+        self.weapon = weapon
+        self.part_roll = part_roll
+        self.crit_roll = crit_roll
+        self.dmg_roll = dmg_roll
+        self.ranges = []
+
+    def choice(self, seq):
+        return seq[self.weapon]
+
+    def random(self):
+        return self.part_roll
+
+    def randint(self, low, high):
+        self.ranges.append((low, high))
+        if len(self.ranges) == 1:
+            return self.crit_roll
+        if self.dmg_roll is None:
+            return int(low)
+        return self.dmg_roll
+
+class Preview(object):
+    """
+    What to expect of a move and combo against someone.
+
+    self.outcomes (dict) - {"win"/"lose"/"both"/"null": chance}
+    self.hit_chance (float) - chance of the move landing (win or both)
+    self.damage (dict) - {damage: chance} when it lands
+    self.bleed (dict) - {bleed: chance} when it lands
+    self.crit_chance (float) - chance of a crit when it lands
+    self.expected_damage (float) - damage to expect, landing or not
+    self.expected_bleed (float) - bleed to expect, landing or not
+    """
+    def __init__(self, outcomes, damage, bleed, crit_chance):
+        self.outcomes = outcomes
+        self.hit_chance = outcomes["win"] + outcomes["both"]
+        self.damage = damage
+        self.bleed = bleed
+        self.crit_chance = crit_chance
+        self.expected_damage = self.hit_chance * _mean(damage)
+        self.expected_bleed = self.hit_chance * _mean(bleed)
+
+    def damage_range(self):
+        """
+        Returns (least, most) damage when the move lands.
+        """
+        return (min(self.damage), max(self.damage))
+
+    def bleed_range(self):
+        """
+        Returns (least, most) bleed when the move lands.
+        """
+        return (min(self.bleed), max(self.bleed))
+
+def _mean(distribution):
+    return sum(value * chance for (value, chance) in distribution.items())
+
+def _health_band(char_state):
+    # the bands roll_round_dam reduces damage by
+    if char_state.has_script("Indomitable Willpower"):
+        return 0
+    health = char_state.get_health_percent()
+    if 0.50 >= health >= 0.25:
+        return 1
+    if health < 0.25:
+        return 2
+    return 0
+
+def fingerprint(attacker, defender, defender_moves, defender_attacking):
+    """
+    Everything a preview depends on, as a tuple. The attacker and
+    defender are CombatantStates with the move and combo to preview.
+    """
+    weapons = tuple((tuple(weapon.damage), weapon.damage_bonus,
+                     weapon.crit_chance, weapon.dmg_type)
+                    for weapon in attacker.usable_weapons())
+    if defender_attacking:
+        defender_combo = defender.combo and defender.combo.name
+    else:
+        defender_combo = None
+    return (attacker.move.name, attacker.combo.name,
+            tuple(defender_move.name for defender_move in defender_moves),
+            defender_attacking, defender_combo,
+            (attacker.pos > defender.pos) - (attacker.pos < defender.pos),
+            weapons, tuple(sorted(attacker.default_weapon.items())),
+            tuple(attacker.stat(stat, "win") for stat in ATTACKER_STATS),
+            _health_band(attacker),
+            id(defender.hit_index), defender.combo and defender.combo.name,
+            defender.armor,
+            tuple(defender.stat(stat, "lose") for stat in DEFENDER_STATS))
+
+def outcome_chances(attacker, defender, defender_moves, defender_attacking):
+    """
+    The chance of each outcome, from the attacker's point of view, if
+    the defender picks any of their moves with the same chance.
+    """
+    chances = dict.fromkeys(OUTCOME_NAMES.values(), 0.0)
+    if not defender_moves:
+        return chances
+    defender_combo = None
+    if defender_attacking:
+        defender_combo = defender.combo
+    share = 1.0 / len(defender_moves)
+    for defender_move in defender_moves:
+        winner = resolve_combat.determine_outcome(attacker.char,
+            attacker.move, attacker.combo, True, defender.char,
+            defender_move, defender_combo, defender_attacking,
+            (attacker.pos, defender.pos))
+        chances[OUTCOME_NAMES[winner]] += share
+    return chances
+
+def _crit_rolls(threshold):
+    # (crit roll, chance) for a crit and for no crit, as roll_round_dam
+    # checks randint(1, 100) / 100.0 against the threshold
+    crits = sum(1 for roll in range(1, 101) if roll / 100.0 <= threshold)
+    rolls = []
+    if crits:
+        rolls.append((1, crits / 100.0))
+    if crits < 100:
+        rolls.append((100, (100 - crits) / 100.0))
+    return rolls
+
+def damage_distribution(attacker, defender):
+    """
+    Works out the exact damage and bleed distributions of the attacker's
+    move landing on the defender, and the chance of a crit.
+
+    Returns (damage, bleed, crit_chance), where damage and bleed are
+    {value: chance} dicts.
+    """
+    damage = {}
+    bleed = {}
+    crit_chance = 0.0
+    weapons = attacker.usable_weapons()
+    if weapons:
+        weapon_cases = [(index, weapon.crit_chance)
+                        for (index, weapon) in enumerate(weapons)]
+    else:
+        weapon_cases = [(0, attacker.default_weapon["crit"])]
+    weapon_share = 1.0 / len(weapon_cases)
+    hit_table = defender.hit_index.table(attacker.move)
+    if hit_table:
+        part_cases = []
+        before = 0
+        for cum_weight in hit_table.cum_weights:
+            roll = (before + (cum_weight - before) / 2.0) / \
+                hit_table.total_weight
+            part_cases.append((roll, (cum_weight - before) * 1.0 /
+                               hit_table.total_weight))
+            before = cum_weight
+    else:
+        part_cases = [(0.0, 1.0)]
+    for (weapon, weapon_crit) in weapon_cases:
+        if hit_table:
+            crit_cases = _crit_rolls(weapon_crit +
+                                     attacker.combo.crit_chance)
+        else:
+            crit_cases = [(100, 1.0)]
+        for (part_roll, part_share) in part_cases:
+            for (crit_roll, crit_share) in crit_cases:
+                # find out the damage range, then go through all of it
+                probe = ScriptedRNG(weapon, part_roll, crit_roll)
+                resolve_combat.roll_round_dam(attacker, defender, True,
+                                              probe)
+                (low, high) = probe.ranges[1]
+                dmg_rolls = range(int(low), max(int(high), int(low)) + 1)
+                share = weapon_share * part_share * crit_share / \
+                    len(dmg_rolls)
+                for dmg_roll in dmg_rolls:
+                    result = resolve_combat.roll_round_dam(attacker,
+                        defender, True, ScriptedRNG(weapon, part_roll,
+                                                    crit_roll, dmg_roll))
+                    damage[result.dmg] = damage.get(result.dmg, 0.0) + share
+                    bleed[result.bleed] = bleed.get(result.bleed, 0.0) + \
+                        share
+                    if result.crit:
+                        crit_chance += share
+    return (damage, bleed, crit_chance)
+
+def preview(attacker_state, defender_state, char_move, char_combo,
+            defender_moves=None, defender_attacking=False):
+    """
+    Returns a Preview of the attacker using the move and combo on the
+    defender. Neither state is changed.
+
+    attacker_state, defender_state - their CombatantStates
+    defender_moves - the moves the defender might pick, every move in
+                     move.CLASSIC_MATRIX if not given
+    defender_attacking - whether the defender is attacking the attacker,
+                         which decides if their combo counts
+    """
+    if char_combo is None:
+        char_combo = resolve_combat.combo.Dummy()
+    if defender_moves is None:
+        defender_moves = move.CLASSIC_MATRIX
+    attacker = attacker_state.with_action(char_move, char_combo)
+    key = fingerprint(attacker, defender_state, defender_moves,
+                      defender_attacking)
+    result = PREVIEW_CACHE.get(key)
+    if result is None:
+        (damage, bleed, crit_chance) = damage_distribution(attacker,
+                                                           defender_state)
+        result = Preview(outcome_chances(attacker, defender_state,
+                                         defender_moves, defender_attacking),
+                         damage, bleed, crit_chance)
+        PREVIEW_CACHE.put(key, result)
+    return result
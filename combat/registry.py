@@ -0,0 +1,208 @@
+"""
+In-memory registry of live combat handlers.
+
+Handlers used to pick their key as "combat_handler_%i" with a random
+number up to 1000, asking the database with search_script whether each
+try was taken, which got slower the more fights there were and could
+run out of keys altogether. The HandlerRegistry hands out keys from a
+counter instead, and indexes every live handler by key, by the ids of
+the characters fighting in it and by the rooms of its battleground, so
+nothing has to search the database for a handler. Inside the package
+handlers are still reached through character.ndb.combat_handler and
+exit.ndb.combat_handler; get, handler_of and handlers_in are for
+commands and scripts outside of it, such as the ones that start fights.
+
+Handlers register themselves in at_start, which the server calls for
+every persistent handler when it starts, so the registry is rebuilt
+from them then, and unregister in at_stop. The counter is moved past
+the key of every handler registered, so a key is never handed out
+twice while its handler is live.
+
+Global scripts the combat package needs (such as StatusStorage) are
+looked up through find_script, once each.
+"""
+from ev import search_script
+
+KEY_PREFIX = "combat_handler_"
+
+class HandlerRegistry(object):
+    """
+    self.next_number (int) - number of the next key to hand out
+    self.by_key (dict) - {key: handler}
+    self.by_participant (dict) - {character id: handler}
+    self.by_room (dict) - {room id: set of the keys of every handler whose
+                          battleground takes the room in}
+    self.rooms (dict) - {key: ids of the rooms it's indexed under}
+    self.scripts (dict) - {key: global script found by find_script}
+    """
+    def __init__(self):
+        self.next_number = 1
+        self.by_key = {}
+        self.by_participant = {}
+        self.by_room = {}
+        self.rooms = {}
+        self.scripts = {}
+
+    def allocate_key(self):
+        """
+        Returns a handler key that no live handler has.
+        """
+        key = "%s%i" % (KEY_PREFIX, self.next_number)
+        self.next_number += 1
+        while key in self.by_key:
+            key = "%s%i" % (KEY_PREFIX, self.next_number)
+            self.next_number += 1
+        return key
+
+    def register(self, handler):
+        """
+        Indexes a live handler, along with everyone fighting in it and
+        its battleground.
+        """
+        key = handler.key
+        self.by_key[key] = handler
+        number = key[len(KEY_PREFIX):]
+        if key.startswith(KEY_PREFIX) and number.isdigit():
+            self.next_number = max(self.next_number, int(number) + 1)
+        for dbref in handler.db.characters or {}:
+            self.by_participant[dbref] = handler
+        self.index_rooms(handler)
+
+    def unregister(self, handler):
+        """
+        Drops a handler and everything indexed under it.
+        """
+        key = handler.key
+        if self.by_key.get(key) is handler:
+            del self.by_key[key]
+        for dbref in handler.db.characters or {}:
+            if self.by_participant.get(dbref) is handler:
+                del self.by_participant[dbref]
+        self._drop_rooms(key)
+
+    def add_participant(self, handler, character):
+        """
+        Notes that the character is fighting in the handler.
+        """
+        self.by_participant[character.id] = handler
+
+    def remove_participant(self, handler, character):
+        """
+        Notes that the character is no longer fighting in the handler.
+        """
+        if self.by_participant.get(character.id) is handler:
+            del self.by_participant[character.id]
+
+    def index_rooms(self, handler):
+        """
+        Indexes the handler under the rooms of its battleground again,
+        for whenever it changes.
+        """
+        key = handler.key
+        self._drop_rooms(key)
+        rooms = set(room.id for room in handler.db.rooms or [])
+        if handler.db.origin_location:
+            rooms.add(handler.db.origin_location.id)
+        for room_id in rooms:
+            self.by_room.setdefault(room_id, set()).add(key)
+        self.rooms[key] = rooms
+
+    def _drop_rooms(self, key):
+        for room_id in self.rooms.pop(key, ()):
+            keys = self.by_room.get(room_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.by_room[room_id]
+
+    def get(self, key):
+        """
+        Returns the live handler with the key, or None.
+        """
+        return self.by_key.get(key)
+
+    def handler_of(self, character):
+        """
+        Returns the handler the character is fighting in, or None.
+        """
+        return self.by_participant.get(character.id)
+
+    def handlers_in(self, room):
+        """
+        Returns every live handler whose battleground takes in the room.
+        """
+        return [self.by_key[key] for key in self.by_room.get(room.id, ())]
+
+    def find_script(self, key):
+        """
+        Returns the global script with the key, searching for it only
+        the first time, or None if there isn't one.
+        """
+        if key not in self.scripts:
+            found = search_script(key)
+            if not found:
+                return None
+            self.scripts[key] = found[0]
+        return self.scripts[key]
+
+REGISTRY = HandlerRegistry()
+
+def allocate_key():
+    """
+    See HandlerRegistry.allocate_key.
+    """
+    return REGISTRY.allocate_key()
+
+def register(handler):
+    """
+    See HandlerRegistry.register.
+    """
+    REGISTRY.register(handler)
+
+def unregister(handler):
+    """
+    See HandlerRegistry.unregister.
+    """
+    REGISTRY.unregister(handler)
+
+def add_participant(handler, character):
+    """
+    See HandlerRegistry.add_participant.
+    """
+    REGISTRY.add_participant(handler, character)
+
+def remove_participant(handler, character):
+    """
+    See HandlerRegistry.remove_participant.
+    """
+    REGISTRY.remove_participant(handler, character)
+
+def index_rooms(handler):
+    """
+    See HandlerRegistry.index_rooms.
+    """
+    REGISTRY.index_rooms(handler)
+
+def get(key):
+    """
+    See HandlerRegistry.get.
+    """
+    return REGISTRY.get(key)
+
+def handler_of(character):
+    """
+    See HandlerRegistry.handler_of.
+    """
+    return REGISTRY.handler_of(character)
+
+def handlers_in(room):
+    """
+    See HandlerRegistry.handlers_in.
+    """
+    return REGISTRY.handlers_in(room)
+
+def find_script(key):
+    """
+    See HandlerRegistry.find_script.
+    """
+    return REGISTRY.find_script(key)
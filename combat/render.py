@@ -0,0 +1,243 @@
+"""
+Compiled combat output templates.
+
+The aesthetic strings on MoveWrappers and Combos (active_str,
+suffix_str, win_str, null_str) are templates with tokens in them:
+
+$s - self's sdesc           $o - opponent's sdesc
+$gs - self's gender         $go - opponent's gender
+$ps - self's pronoun        $po - opponent's pronoun
+$ws - self's weapon         $wo - opponent's weapon
+$bo - opponent's body part
+
+combat_str_replace used to fill these in with a str.replace pass per
+token over the whole output so far. Here every template is split into
+segments once, the first time it's used, and rendered in a single pass
+from a RenderContext, whose actor strings are worked out once per turn
+(see Actor). Tokens are never looked for inside what we fill in, so an
+sdesc with a $ in it can't corrupt the output.
+
+Most of an exchange's output doesn't depend on who's fighting at all,
+only on the wrappers, moves, combos, outcome, weapons and body parts.
+combat_output builds each combination of those once, with SLOT_ONE and
+SLOT_TWO standing in for the actors, and keeps it in OUTPUT_CACHE as
+fragments. After that, only the actors' strings get filled in.
+"""
+import re
+from collections import OrderedDict
+
+# longest tokens first, so $ws isn't read as $s
+TOKEN_RE = re.compile(r"\$(ws|wo|gs|go|ps|po|bo|s|o)")
+
+_templates = {}
+
+def compile_template(template):
+    """
+    Splits the template into a tuple of (text, token) segments, where
+    token is the name of the token after the text, or None at the end.
+    Templates are only compiled once.
+    """
+    try:
+        return _templates[template]
+    except KeyError:
+        pass
+    segments = []
+    start = 0
+    for match in TOKEN_RE.finditer(template):
+        segments.append((template[start:match.start()], match.group(1)))
+        start = match.end()
+    segments.append((template[start:], None))
+    segments = tuple(segments)
+    _templates[template] = segments
+    return segments
+
+def render(template, context):
+    """
+    Renders the template with the given RenderContext.
+    """
+    if not isinstance(template, str):
+        # eg. Break's win_str dict, which is shown as it is
+        template = "%s" % (template,)
+    values = context.values
+    parts = []
+    for (text, token) in compile_template(template):
+        parts.append(text)
+        if token:
+            parts.append(values[token])
+    return "".join(parts)
+
+# wrapper signature: small id, see WrapperIndex
+_wrapper_ids = {}
+
+class WrapperIndex(object):
+    """
+    A move wrapper (list of MoveWrappers) indexed by move name, so
+    finding the wrapper for a move isn't a scan.
+
+    self.key (int) - the same for every wrapper with the same strings,
+                     for keying cached output
+    self.moves (dict) - {move name: MoveWrapper}
+    """
+    __slots__ = ("key", "moves")
+
+    def __init__(self, wrapper):
+        self.moves = {}
+        signature = []
+        for wrap_move in wrapper:
+            name = wrap_move.move_name.name
+            # the first wrapper for a move wins, as with the old scans
+            self.moves.setdefault(name, wrap_move)
+            signature.append((name, wrap_move.active_str,
+                              wrap_move.suffix_str,
+                              tuple(sorted(wrap_move.win_str.items())),
+                              tuple(sorted(wrap_move.null_str.items()))))
+        self.key = _wrapper_ids.setdefault(tuple(signature),
+                                           len(_wrapper_ids))
+
+    def find(self, move):
+        """
+        Returns the MoveWrapper for the move.
+        """
+        return self.moves[move.name]
+
+class Actor(object):
+    """
+    Everything about a combatant that goes into combat output, read
+    once per turn.
+
+    self.name (string) - highlighted sdesc, for $s and $o
+    self.cap_name (string) - highlighted, capitalized sdesc, for
+                             starting a sentence
+    self.gender (string) - highlighted gender string, for $gs and $go
+    self.pronoun (string) - highlighted pronoun, for $ps and $po
+    self.move_wrapper (WrapperIndex) - for fighting with the default weapon
+    """
+    __slots__ = ("sdesc", "name", "cap_name", "gender", "pronoun",
+                 "default_weapon", "move_wrapper")
+
+    def __init__(self, char):
+        self.sdesc = char.db.sdesc
+        self.name = "{M%s{n" % self.sdesc
+        self.cap_name = "{M%s{n" % self.sdesc.capitalize()
+        self.gender = "{M%s{n" % char.genderize_str()
+        self.pronoun = "{M%s{n" % char.genderize_str(2)
+        self.default_weapon = char.db.default_weapon["name"]
+        self.move_wrapper = WrapperIndex(char.db.move_wrapper)
+
+class RenderContext(object):
+    """
+    Token values for rendering from one actor's point of view.
+    """
+    __slots__ = ("values",)
+
+    def __init__(self, att, vict, att_weapon, vict_weapon, vict_body=None):
+        if vict_body:
+            body = vict_body.singular_name
+        else:
+            # a win that didn't land on any body part
+            body = "body"
+        self.values = {"s": att.name, "o": vict.name, "gs": att.gender,
+                       "go": vict.gender, "ps": att.pronoun,
+                       "po": vict.pronoun, "ws": att_weapon,
+                       "wo": vict_weapon, "bo": body}
+
+# the actor strings that can be slotted into cached output
+ACTOR_FIELDS = ("name", "cap_name", "gender", "pronoun")
+SLOT_RE = re.compile("\x00([01])([0-3])\x00")
+
+class SlotActor(object):
+    """
+    Stands in for an Actor while building output to cache, with markers
+    where the actor's strings go.
+    """
+    __slots__ = ACTOR_FIELDS
+
+    def __init__(self, slot):
+        for (index, field) in enumerate(ACTOR_FIELDS):
+            setattr(self, field, "\x00%d%d\x00" % (slot, index))
+
+SLOT_ONE = SlotActor(0)
+SLOT_TWO = SlotActor(1)
+
+def compile_slots(string):
+    """
+    Splits output built with SLOT_ONE and SLOT_TWO into a tuple of
+    (text, slot, field) fragments, where slot and field say which
+    actor string goes after the text, or are None at the end.
+    """
+    fragments = []
+    start = 0
+    for match in SLOT_RE.finditer(string):
+        fragments.append((string[start:match.start()], int(match.group(1)),
+                          ACTOR_FIELDS[int(match.group(2))]))
+        start = match.end()
+    fragments.append((string[start:], None, None))
+    return tuple(fragments)
+
+def fill_slots(fragments, actor_one, actor_two):
+    """
+    Fills the actors' strings into compiled fragments.
+    """
+    actors = (actor_one, actor_two)
+    parts = []
+    for (text, slot, field) in fragments:
+        parts.append(text)
+        if field:
+            parts.append(getattr(actors[slot], field))
+    return "".join(parts)
+
+class FragmentCache(object):
+    """
+    A bounded LRU of compiled output fragments.
+
+    self.hits (int) - lookups that found their fragments
+    self.misses (int) - lookups that didn't
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the fragments cached for the key, or None.
+        """
+        try:
+            fragments = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # back on the end, as the most recently used
+        self.entries[key] = fragments
+        self.hits += 1
+        return fragments
+
+    def put(self, key, fragments):
+        """
+        Caches the fragments, dropping the least recently used entry
+        if we're full.
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = fragments
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache and resets the counters.
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and size, as a dict.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+# how many combinations of combat output to keep
+OUTPUT_CACHE_SIZE = 1024
+OUTPUT_CACHE = FragmentCache(OUTPUT_CACHE_SIZE)
@@ -0,0 +1,369 @@
+"""
+Turn records and offline replay.
+
+With a turn log, resolve_combat records every turn it resolves: the
+combatants' states as they went into it (see CombatantState.detach), the
+moves and combos, who was fighting whom, the flee/rescue/shift attempts,
+the turn's seed and how far its stream had been drawn (see rng.py), and
+then how it came out, the outcome of every exchange and everything it
+did to each combatant.
+
+replay plays recorded turns again with none of the game around, with
+stand-ins for the characters, their weapons and the combat handler, and
+checks that every turn comes out exactly as it did live. A turn that
+comes out differently means something random was drawn from somewhere
+other than the turn's stream, or something was read that the record
+doesn't have.
+
+    log = replay.load_records("turns.log")
+    for result in replay.replay(log, first=10, last=20):
+        if not result.matched:
+            print result.turn, result.differences
+
+Records only hold plain data and the pickled states, so they can be
+written out as they're made (see TurnLog) and replayed somewhere else.
+"""
+import collections
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from game.gamesrc.combat import pair_graph
+from game.gamesrc.combat import rng as combat_rng
+
+# how many turns a handler's log keeps in memory
+TURN_LOG_SIZE = 50
+# directory every handler's turns are also written out to, or None
+TURN_LOG_DIR = None
+
+class TurnLog(object):
+    """
+    A combat handler's recent turn records.
+
+    self.records (deque) - the last TURN_LOG_SIZE records
+    self.path (string) - file every record is also appended to, or None
+    """
+    def __init__(self, maxlen=TURN_LOG_SIZE, path=None):
+        self.records = collections.deque(maxlen=maxlen)
+        self.path = path
+
+    def append(self, record):
+        """
+        Adds a turn record, writing it out if we have a path.
+        """
+        self.records.append(record)
+        if self.path:
+            with open(self.path, "ab") as log_file:
+                pickle.dump(record, log_file, pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+def log_path(name):
+    """
+    Where the turns of the log by this name are written out to, or None
+    if they're only kept in memory.
+    """
+    if not TURN_LOG_DIR:
+        return None
+    return os.path.join(TURN_LOG_DIR, "%s.turns" % name)
+
+def load_records(path):
+    """
+    Reads every turn record TurnLog wrote to the file, as a list.
+    """
+    records = []
+    with open(path, "rb") as log_file:
+        while True:
+            try:
+                records.append(pickle.load(log_file))
+            except EOFError:
+                return records
+
+def _effect_name(effect):
+    # status effects are queued up as keys or script classes
+    return getattr(effect, "key", None) or \
+        getattr(effect, "__name__", None) or "%s" % (effect,)
+
+def _ids(mapping):
+    # {dbref: character} to {dbref: dbref}
+    return dict((dbref, char.id) for (dbref, char) in mapping.items()
+                if char)
+
+def record_turn(states, moves, combos, graph, combat_handler, rng):
+    """
+    Starts the record of a turn, from everything that goes into
+    resolving it. Has to be called before anything is resolved.
+
+    Returns the record, as a dict.
+    """
+    db = combat_handler.db
+    return {"turn": rng.turn, "seed": rng.turn_seed, "draws": rng.draws,
+            "states": dict((dbref, char_state.detach())
+                           for (dbref, char_state) in states.items()),
+            "moves": dict((dbref, moves[dbref]["move"]) for dbref in states),
+            "combos": dict((dbref, combos[dbref]) for dbref in states),
+            "pairs": list(graph.exchanges),
+            "targets": dict(graph.targets),
+            "flee_count": dict(db.flee_count or {}),
+            "shifting": _ids(db.shifting or {}),
+            "rescuing": _ids(db.rescuing or {})}
+
+def turn_deltas(states):
+    """
+    Everything the turn did to every combatant, as
+    {dbref: (health, pos, wounds, heal_ticks)}, where wounds are
+    (body part name, damage, bleed, dmg_type) tuples.
+    """
+    deltas = {}
+    for (dbref, char_state) in states.items():
+        char_wounds = tuple((getattr(location, "name", None), damage, bleed,
+                             dmg_type)
+                            for (location, damage, bleed, dmg_type) in
+                            char_state.wounds)
+        deltas[dbref] = (char_state.health, char_state.pos, char_wounds,
+                         char_state.heal_ticks)
+    return deltas
+
+def turn_effects(turn_effects):
+    """
+    The status effects queued up over the turn, as
+    {dbref: sorted (effect name, repeats) tuples}.
+    """
+    return dict((dbref, tuple(sorted((_effect_name(effect), repeats)
+                                     for (effect, repeats) in
+                                     effects.items())))
+                for (dbref, effects) in turn_effects.items() if effects)
+
+def turn_outcomes(outcomes):
+    """
+    Every exchange's (p_one, p_one_attacking, p_two, p_two_attacking,
+    winner) tuple, with the characters as their dbrefs.
+    """
+    return [(p_one.id, p_one_attacking, p_two.id, p_two_attacking, winner)
+            for (p_one, p_one_attacking, p_two, p_two_attacking, winner) in
+            outcomes]
+
+def finish_record(record, mode, outcomes, states, combat_handler):
+    """
+    Adds how the turn came out to its record.
+    """
+    record["mode"] = mode
+    record["outcomes"] = turn_outcomes(outcomes)
+    record["deltas"] = turn_deltas(states)
+    record["effects"] = turn_effects(combat_handler.db.turn_effects or {})
+
+class ReplayAttributes(object):
+    """
+    Stands in for db/ndb on replay stand-ins.
+    """
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name):
+        # as with Evennia, attributes that were never set are None
+        return None
+
+class ReplayScripts(object):
+    """
+    A script handler with no scripts on it.
+    """
+    def all(self):
+        return []
+
+    def get(self, key):
+        return []
+
+class ReplayCharacter(object):
+    """
+    Stands in for a character in a replayed turn.
+    """
+    def __init__(self, char_state, combat_handler):
+        self.id = char_state.id
+        self.key = char_state.actor.sdesc
+        self.db = ReplayAttributes(sdesc=char_state.actor.sdesc,
+                                   health=char_state.health,
+                                   max_health=char_state.max_health)
+        self.ndb = ReplayAttributes(combat_handler=combat_handler,
+                                    pos=char_state.pos,
+                                    modifiers=char_state.modifiers,
+                                    eff_multipliers=
+                                        char_state.eff_multipliers)
+        self.scripts = ReplayScripts()
+
+    def msg(self, message, *args, **kwargs):
+        pass
+
+class ReplayObject(object):
+    """
+    Stands in for a weapon or shield in a replayed turn.
+    """
+    def __init__(self, weapon_state):
+        self.id = weapon_state.id
+        self.db = ReplayAttributes(dmg_type=weapon_state.dmg_type,
+                                   weapon_type=weapon_state.weapon_type,
+                                   hands=weapon_state.hands,
+                                   quality=weapon_state.quality,
+                                   broken=weapon_state.broken)
+
+    def break_weapon(self):
+        self.db.broken = True
+
+class ReplayGraph(pair_graph.PairGraph):
+    """
+    A PairGraph that gives back the recorded exchanges, in their
+    recorded order.
+    """
+    def __init__(self, chars, targets, pairs):
+        pair_graph.PairGraph.__init__(self)
+        for (attacker, victim) in targets.items():
+            self.set_target(chars[attacker], chars[victim])
+        self.recorded_pairs = [(chars[low], chars[high])
+                               for (low, high) in pairs]
+
+    def pairs(self):
+        return list(self.recorded_pairs)
+
+class ReplayHandler(object):
+    """
+    Stands in for the combat handler in a replayed turn, doing what the
+    handler does to its own bookkeeping and nothing else.
+    """
+    def __init__(self, record):
+        self.states = {}
+        self.chars = {}
+        for (dbref, recorded) in record["states"].items():
+            char_state = recorded.detach()
+            char = ReplayCharacter(char_state, self)
+            char_state.char = char
+            for weapon in char_state.weapons:
+                weapon.obj = ReplayObject(weapon)
+            if char_state.shield:
+                char_state.shield.obj = ReplayObject(char_state.shield)
+            self.states[dbref] = char_state
+            self.chars[dbref] = char
+        chars = self.chars
+        self.graph = ReplayGraph(chars, record["targets"], record["pairs"])
+        self.moves = dict((dbref, {"move": char_move})
+                          for (dbref, char_move) in record["moves"].items())
+        self.combos = record["combos"]
+        self.db = ReplayAttributes(
+            pairs=dict((chars[att], chars[vict]) for (att, vict) in
+                       record["targets"].items()),
+            flee_count=dict(record["flee_count"]),
+            shifting=dict((dbref, chars[tgt]) for (dbref, tgt) in
+                          record["shifting"].items() if tgt in chars),
+            rescuing=dict((dbref, chars[tgt]) for (dbref, tgt) in
+                          record["rescuing"].items() if tgt in chars),
+            turn_effects=dict((dbref, {}) for dbref in chars))
+
+    def get_pair_graph(self):
+        return self.graph
+
+    def msg_all(self, message, prompt=True):
+        pass
+
+    def add_status_effect(self, char, status_effect, repeats=None):
+        self.db.turn_effects[char.id][status_effect] = repeats
+
+    def add_flee_count(self, char):
+        flee_count = self.db.flee_count
+        flee_count[char.id] = min(flee_count.get(char.id, -1) + 1, 2)
+
+    def del_flee_char(self, char):
+        self.db.flee_count.pop(char.id, None)
+
+    def remove_character(self, char):
+        self.graph.drop_target(char)
+        self.db.pairs.pop(char, None)
+
+    def switch_target(self, char, new_target):
+        self.db.shifting.pop(char.id, None)
+        self.db.pairs[char] = new_target
+        self.graph.set_target(char, new_target)
+
+    def rescue_tgt(self, char, tgt):
+        attacker = self.db.pairs[tgt]
+        self.db.pairs[attacker] = char
+        self.graph.set_target(attacker, char)
+        self.del_rescue(char)
+
+    def del_rescue(self, char):
+        self.db.rescuing.pop(char.id, None)
+
+class ReplayResult(object):
+    """
+    How a replayed turn compared to the record.
+
+    self.turn (int) - the turn's number, from its CombatRNG
+    self.matched (boolean) - whether it came out exactly the same
+    self.differences (list) - what didn't, as strings
+    """
+    def __init__(self, turn, differences):
+        self.turn = turn
+        self.matched = not differences
+        self.differences = differences
+
+    def __repr__(self):
+        return "<ReplayResult turn %s: %s>" % (self.turn,
+            self.matched and "matched" or
+            "%d differences" % len(self.differences))
+
+def _compare(name, recorded, replayed, differences):
+    for dbref in sorted(set(recorded) | set(replayed)):
+        if recorded.get(dbref) != replayed.get(dbref):
+            differences.append("%s of #%s: recorded %r, replayed %r" %
+                (name, dbref, recorded.get(dbref), replayed.get(dbref)))
+
+def replay_turn(record):
+    """
+    Plays a recorded turn again, and returns a ReplayResult.
+    """
+    # resolve_combat imports us, so we can only import it once we're loaded
+    from game.gamesrc.combat import resolve_combat
+    differences = []
+    try:
+        combat_handler = ReplayHandler(record)
+        states = combat_handler.states
+        rng = combat_rng.CombatRNG.for_turn(record["seed"])
+        rng.skip(record["draws"])
+        (mode, outcomes) = resolve_combat.resolve_turn(states,
+            combat_handler.graph, combat_handler.moves,
+            combat_handler.combos, rng, record["mode"], inline=True)
+    except Exception as err:
+        return ReplayResult(record["turn"],
+                            ["replay failed: %s: %s" %
+                             (err.__class__.__name__, err)])
+    outcomes = turn_outcomes(outcomes)
+    if outcomes != record["outcomes"]:
+        differences.append("outcomes: recorded %r, replayed %r" %
+                           (record["outcomes"], outcomes))
+    _compare("deltas", record["deltas"], turn_deltas(states), differences)
+    _compare("effects", record["effects"],
+             turn_effects(combat_handler.db.turn_effects), differences)
+    return ReplayResult(record["turn"], differences)
+
+def replay(records, first=None, last=None):
+    """
+    Plays every recorded turn numbered from first to last (both
+    included, and either can be left out) again, and returns a list of
+    their ReplayResults.
+    """
+    results = []
+    for record in records:
+        if first is not None and record["turn"] < first:
+            continue
+        if last is not None and record["turn"] > last:
+            continue
+        results.append(replay_turn(record))
+    return results
+
+def verify(records, first=None, last=None):
+    """
+    Whether every recorded turn from first to last replays exactly.
+    """
+    return all(result.matched for result in replay(records, first, last))
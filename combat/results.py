@@ -0,0 +1,145 @@
+"""
+What an exchange comes out as.
+
+Every exchange used to be described by a damage_dict per combatant, a
+nine-key dict with two more dicts nested in it for status effects,
+passed from the damage roll through positioning, output and personal
+messages and read back with string keys. An ExchangeResult holds the
+same thing in slots, and a PositionResult holds what calc_round_pos
+worked out for the pair.
+
+ExchangeResults are handed out by RESULT_POOL and taken back at the
+start of the next turn (see resolve_combat.resolve_turn), so a turn
+reuses the results of the last one rather than allocating its own.
+Nothing should hold on to an ExchangeResult past the end of its turn.
+"""
+
+# how many spare ExchangeResults to keep around, 0 turns pooling off
+RESULT_POOL_SIZE = 512
+
+class ExchangeResult(object):
+    """
+    What one combatant did to the other in an exchange.
+
+    self.weapon - the weapon object they hit with, None if barehanded
+    self.dmg (float) - damage done
+    self.dmg_type (string) - "edge", "blunt" or "pierce"
+    self.bleed (float) - bleed done
+    self.bodypart (BodyPart) - the part they hit, or None
+    self.crit (boolean) - whether it was a critical hit
+    self.crit_effect - the status effect the crit inflicts, or None
+    self.self_effect (dict) - {effect: repeats} on the attacker, or None
+    self.vict_effect (dict) - {effect: repeats} on the vict, or None
+    """
+    __slots__ = ("weapon", "dmg", "dmg_type", "bleed", "bodypart", "crit",
+                 "crit_effect", "self_effect", "vict_effect")
+
+    def __init__(self, weapon=None, dmg=0, dmg_type=None, bleed=0,
+                 bodypart=None, crit=False, crit_effect=None):
+        self.weapon = weapon
+        self.dmg = dmg
+        self.dmg_type = dmg_type
+        self.bleed = bleed
+        self.bodypart = bodypart
+        self.crit = crit
+        self.crit_effect = crit_effect
+        self.self_effect = None
+        self.vict_effect = None
+
+    def reset(self):
+        """
+        Clears the result out for reuse.
+        """
+        self.__init__()
+
+    def add_self_effect(self, effect, repeats):
+        """
+        Queues up a status effect on the attacker.
+        """
+        if self.self_effect is None:
+            self.self_effect = {}
+        self.self_effect[effect] = repeats
+
+    def add_vict_effect(self, effect, repeats):
+        """
+        Queues up a status effect on the vict.
+        """
+        if self.vict_effect is None:
+            self.vict_effect = {}
+        self.vict_effect[effect] = repeats
+
+    def __repr__(self):
+        return "<ExchangeResult %s dmg, %s bleed on %s%s>" % (self.dmg,
+            self.bleed, self.bodypart, self.crit and " (crit)" or "")
+
+class PositionResult(object):
+    """
+    The positioning of a pair after an exchange.
+
+    self.pos_one (int) - what the first of the pair gained
+    self.pos_two (int) - what the second of the pair gained
+    self.cost_one (int) - what the first of the pair's combo cost them
+    self.cost_two (int) - what the second of the pair's combo cost them
+    self.break_weapon - the weapon a break broke, "fail" if it failed,
+                        or None
+    """
+    __slots__ = ("pos_one", "pos_two", "cost_one", "cost_two",
+                 "break_weapon")
+
+    def __init__(self, pos_one=0, pos_two=0, cost_one=0, cost_two=0,
+                 break_weapon=None):
+        self.pos_one = pos_one
+        self.pos_two = pos_two
+        self.cost_one = cost_one
+        self.cost_two = cost_two
+        self.break_weapon = break_weapon
+
+    def __repr__(self):
+        return "<PositionResult %+d/%+d>" % (self.pos_one - self.cost_one,
+                                             self.pos_two - self.cost_two)
+
+class ResultPool(object):
+    """
+    Spare ExchangeResults, and the ones handed out since the last
+    recycle.
+    """
+    def __init__(self, maxsize=RESULT_POOL_SIZE):
+        self.maxsize = maxsize
+        self.free = []
+        self.used = []
+
+    def acquire(self):
+        """
+        Returns a cleared ExchangeResult, a spare one if we have any.
+        """
+        if self.free:
+            result = self.free.pop()
+            result.reset()
+        else:
+            result = ExchangeResult()
+        # anything past maxsize is left to the garbage collector
+        if len(self.used) < self.maxsize:
+            self.used.append(result)
+        return result
+
+    def recycle(self):
+        """
+        Takes back every result handed out since the last recycle.
+        """
+        self.free.extend(self.used[:self.maxsize - len(self.free)])
+        self.used = []
+
+RESULT_POOL = ResultPool()
+
+def new_result():
+    """
+    Returns a cleared ExchangeResult for an exchange.
+    """
+    return RESULT_POOL.acquire()
+
+def recycle():
+    """
+    Takes back every ExchangeResult handed out since the last recycle,
+    see ResultPool.recycle.
+    """
+    RESULT_POOL.recycle()
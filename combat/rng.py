@@ -0,0 +1,126 @@
+"""
+Seeded random number streams for combat.
+
+Every combat handler owns a CombatRNG. At the start of each turn it
+draws a fresh seed for the turn from its own master stream and records
+it, and everything random about the turn (stance picks, stop requests,
+weapon and body part picks, crits, damage rolls, weapon breaks) is drawn
+from a stream seeded with it. Given the turn's seed and what went into
+it, the turn can be played out again exactly.
+
+Randomness is drawn in blocks rather than one value at a time, from a
+NumPy Generator when NumPy is available and a random.Random when not.
+CombatRNG has random, randint and choice like the random module, so
+anything that takes an rng can be handed either.
+"""
+import collections
+import random
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# how many floats we pre-draw at a time
+BLOCK_SIZE = 256
+# how many turn seeds we remember
+HISTORY_SIZE = 100
+
+class CombatRNG(object):
+    """
+    A seeded, per-turn random stream.
+
+    self.seed - the master seed, None if it came from the system
+    self.turn (int) - how many turns have been started
+    self.turn_seed (int) - the seed of the current turn
+    self.draws (int) - how many values have been drawn this turn
+    self.history (deque) - (turn, turn_seed) for the last HISTORY_SIZE
+                           turns
+    """
+    def __init__(self, seed=None, turn_seed=None):
+        self.seed = seed
+        self.master = random.Random(seed)
+        self.turn = 0
+        self.turn_seed = None
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.start_turn(turn_seed)
+
+    @classmethod
+    def for_turn(cls, turn_seed):
+        """
+        Returns a CombatRNG set up to replay the turn with the given seed.
+        """
+        return cls(turn_seed=turn_seed)
+
+    def start_turn(self, turn_seed=None):
+        """
+        Starts the stream for a new turn, with a seed drawn from the
+        master stream unless one is given, and returns the seed.
+        """
+        if turn_seed is None:
+            turn_seed = self.master.getrandbits(32)
+        self.turn += 1
+        self.turn_seed = turn_seed
+        self.history.append((self.turn, turn_seed))
+        if numpy is not None:
+            self._generator = numpy.random.default_rng(turn_seed)
+        else:
+            self._generator = random.Random(turn_seed)
+        self._block = []
+        self._index = 0
+        self.draws = 0
+        return turn_seed
+
+    def generator(self):
+        """
+        The turn's NumPy Generator, for drawing whole arrays (see
+        batch.py), or None without NumPy.
+        """
+        if numpy is None:
+            return None
+        return self._generator
+
+    def _fill(self):
+        if numpy is not None:
+            self._block = self._generator.random(BLOCK_SIZE).tolist()
+        else:
+            draw = self._generator.random
+            self._block = [draw() for i in range(BLOCK_SIZE)]
+        self._index = 0
+
+    def random(self):
+        """
+        Returns the next float from 0 up to 1.
+        """
+        if self._index >= len(self._block):
+            self._fill()
+        value = self._block[self._index]
+        self._index += 1
+        self.draws += 1
+        return value
+
+    def skip(self, count):
+        """
+        Draws and throws away count values, to pick a replayed turn up
+        from where its stream was.
+        """
+        for i in range(count):
+            self.random()
+
+    def randint(self, low, high):
+        """
+        Returns a whole number from low to high, both included.
+        """
+        return int(low) + int(self.random() * (int(high) - int(low) + 1))
+
+    def choice(self, seq):
+        """
+        Returns a random element of the sequence.
+        """
+        return seq[int(self.random() * len(seq))]
+
+    def derive_seed(self):
+        """
+        Returns a seed for a stream of its own, such as a cluster rolled
+        in the process pool.
+        """
+        return int(self.random() * 0x100000000)
@@ -0,0 +1,265 @@
+"""
+One round scheduler for every combat handler.
+
+Every CombatHandler used to be a Script with an interval of
+COMBAT_ROUND_TIMEOUT, so N fights meant N timers, each going off
+whenever it happened to and resolving its turn by itself. The
+RoundScheduler keeps every handler's next round deadline in one heap
+instead, checked by a single looping call every SCHEDULER_TICK seconds.
+Handlers whose rounds fall due in the same tick are run together as a
+batch: every turn is resolved into one shared commit.CombatCommit
+which is flushed once, and only then does anyone get their prompt. With
+the process pool on (see parallel.py), every round in the batch has its
+damage rolled in the pool together before any of them is resolved.
+Each phase of a round is run handler by handler, so one that fails is
+logged and only fails its own round, and every handler's next round is
+scheduled whatever happens to the batch.
+
+Handlers schedule themselves when they start and cancel when they stop
+(see CombatHandler.at_start/at_stop). Operators can see how it's doing
+with, eg.
+
+    @py from game.gamesrc.combat import round_scheduler; self.msg(round_scheduler.metrics())
+"""
+from collections import deque
+import heapq
+import time
+from twisted.internet import task
+from ev import logger
+from game.gamesrc.combat import commit
+from game.gamesrc.combat import parallel
+from game.gamesrc.combat import resolve_combat
+from game.gamesrc.combat import results
+from game.gamesrc.combat import tracing
+
+# how often the scheduler checks for rounds that are due, in seconds
+SCHEDULER_TICK = 1
+# how many of the latest rounds' lag to average over
+LAG_SAMPLES = 100
+
+class RoundScheduler(object):
+    """
+    self.heap (list) - (deadline, sequence, handler id) for every round
+                       scheduled, including ones since cancelled or moved
+    self.deadlines (dict) - {handler id: (deadline, sequence) of its live
+                            entry in the heap}
+    self.handlers (dict) - {handler id: handler} for every handler
+                           scheduled, including ones running their round
+    self.intervals (dict) - {handler id: seconds between its rounds}
+    self.lags (deque) - how late each of the latest rounds ran, in seconds
+    """
+    def __init__(self, tick=SCHEDULER_TICK, clock=time.time):
+        self.tick_interval = tick
+        self.clock = clock
+        self.heap = []
+        self.deadlines = {}
+        self.handlers = {}
+        self.intervals = {}
+        self.sequence = 0
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.max_lag = 0
+        self.rounds = 0
+        self.batches = 0
+        self.last_batch = 0
+        self.last_duration = 0
+        self.looping = None
+
+    def schedule(self, handler, interval, delay=None):
+        """
+        Runs the handler's rounds every interval seconds, the first of
+        them in delay seconds (interval if not given).
+        """
+        self.handlers[handler.id] = handler
+        self.intervals[handler.id] = interval
+        if delay is None:
+            delay = interval
+        self._push(handler.id, self.clock() + delay)
+        self.start()
+
+    def _push(self, dbref, deadline):
+        # any entry the handler already had is left in the heap, and
+        # skipped when it comes up since it's no longer in deadlines
+        self.sequence += 1
+        self.deadlines[dbref] = (deadline, self.sequence)
+        heapq.heappush(self.heap, (deadline, self.sequence, dbref))
+
+    def expedite(self, handler, delay=0):
+        """
+        Moves the handler's next round up to delay seconds from now, or
+        the next tick, unless it's due sooner than that already.
+        """
+        if handler.id not in self.deadlines:
+            return
+        deadline = self.clock() + delay
+        if deadline < self.deadlines[handler.id][0]:
+            self._push(handler.id, deadline)
+
+    def cancel(self, handler):
+        """
+        Stops running the handler's rounds.
+        """
+        self.deadlines.pop(handler.id, None)
+        self.handlers.pop(handler.id, None)
+        self.intervals.pop(handler.id, None)
+        if not self.handlers:
+            self.heap = []
+            self.stop()
+
+    def time_left(self, handler):
+        """
+        Seconds until the handler's next round, or None if it has none.
+        """
+        if handler.id not in self.deadlines:
+            return None
+        return max(0, self.deadlines[handler.id][0] - self.clock())
+
+    def pop_due(self, now):
+        """
+        Takes every handler whose round is due off the heap, in the order
+        they fell due, and returns them.
+        """
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            (deadline, sequence, dbref) = heapq.heappop(heap)
+            if self.deadlines.get(dbref) != (deadline, sequence):
+                continue
+            del self.deadlines[dbref]
+            lag = now - deadline
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            due.append(self.handlers[dbref])
+        return due
+
+    def tick(self):
+        """
+        Runs every round that's due, and schedules the next round of
+        every handler still going.
+        """
+        now = self.clock()
+        due = self.pop_due(now)
+        if not due:
+            return
+        try:
+            self.run_batch(due)
+        except Exception as err:
+            # anything raised out of here would stop the looping call,
+            # and every fight with it
+            logger.log_errmsg("Combat round batch failed: %s" % err)
+        finally:
+            self.last_duration = self.clock() - now
+            for handler in due:
+                # handlers that stopped during their round have cancelled
+                if handler.id in self.handlers and \
+                        handler.id not in self.deadlines:
+                    self._push(handler.id, now + self.intervals[handler.id])
+
+    def _each(self, handlers, phase, *args):
+        # runs a phase of every handler's round that's still going, so
+        # that one of them failing doesn't hold up the rest
+        for handler in handlers:
+            if handler.id not in self.handlers:
+                continue
+            try:
+                getattr(handler, phase)(*args)
+            except Exception as err:
+                logger.log_errmsg("Combat round of %s failed in %s: %s" %
+                                  (handler.key, phase, err))
+
+    def run_batch(self, handlers):
+        """
+        Runs the rounds of the handlers together, sharing their commit
+        and, if there are enough pairs between them, the process pool.
+        """
+        self._each(handlers, "start_turn")
+        self._each(handlers, "snapshot_modifiers")
+        pair_count = sum(len(handler.get_pair_graph().exchanges)
+                         for handler in handlers
+                         if handler.id in self.handlers)
+        if parallel.can_pool(pair_count):
+            # every round's damage goes into the pool before we wait on
+            # any of it, so the rounds are rolled across every worker
+            results.recycle()
+            pool_batch = parallel.PoolBatch(resolve_combat.roll_round_dam)
+            self._each(handlers, "roll_round", pool_batch)
+            pool_batch.wait()
+        turn_commit = commit.CombatCommit()
+        self._each(handlers, "resolve_round", turn_commit)
+        turn_commit.flush()
+        self._each(handlers, "finish_turn")
+        self.rounds += len(handlers)
+        self.batches += 1
+        self.last_batch = len(handlers)
+        tracing.trace("scheduler", tracing.INFO,
+                      "Ran %s rounds together, %s queued.", len(handlers),
+                      len(self.deadlines))
+
+    def metrics(self):
+        """
+        Returns how the scheduler is doing, as a dict.
+
+        queued - handlers waiting for their next round
+        heap - entries in the heap, cancelled and moved ones included
+        rounds, batches - rounds run so far, and how many batches
+        last_batch - rounds in the last batch
+        last_duration - seconds the last batch took
+        mean_lag, max_lag - how many seconds late rounds have been
+                            running, over the latest LAG_SAMPLES and ever
+        """
+        mean_lag = 0
+        if self.lags:
+            mean_lag = sum(self.lags) / len(self.lags)
+        return {"queued": len(self.deadlines), "heap": len(self.heap),
+                "rounds": self.rounds, "batches": self.batches,
+                "last_batch": self.last_batch,
+                "last_duration": self.last_duration,
+                "mean_lag": mean_lag, "max_lag": self.max_lag}
+
+    def start(self):
+        """
+        Starts the looping call, if it isn't going already.
+        """
+        if self.looping is None:
+            self.looping = task.LoopingCall(self.tick)
+            self.looping.start(self.tick_interval, now=False)
+
+    def stop(self):
+        """
+        Stops the looping call, if it's going.
+        """
+        if self.looping is not None:
+            if self.looping.running:
+                self.looping.stop()
+            self.looping = None
+
+SCHEDULER = RoundScheduler()
+
+def schedule(handler, interval, delay=None):
+    """
+    See RoundScheduler.schedule.
+    """
+    SCHEDULER.schedule(handler, interval, delay)
+
+def expedite(handler, delay=0):
+    """
+    See RoundScheduler.expedite.
+    """
+    SCHEDULER.expedite(handler, delay)
+
+def cancel(handler):
+    """
+    See RoundScheduler.cancel.
+    """
+    SCHEDULER.cancel(handler)
+
+def time_left(handler):
+    """
+    See RoundScheduler.time_left.
+    """
+    return SCHEDULER.time_left(handler)
+
+def metrics():
+    """
+    See RoundScheduler.metrics.
+    """
+    return SCHEDULER.metrics()
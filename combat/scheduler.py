@@ -0,0 +1,81 @@
+"""
+Scheduling a turn's exchanges for n-way melees.
+
+The resolver used to take a turn one exchange at a time, and everything
+an exchange did to its pair happened there and then: wounds came off
+health, positioning moved, and apply_status and check_special_status
+ran for both of them. With three people on one victim, the victim's
+heal ticks and internal bleeding went in three times, a flee was
+counted three times over, and every exchange was resolved against what
+the ones before it had left of the victim, so the turn came out
+differently depending on the order its exchanges were in.
+
+An ExchangeSchedule lays the turn out as the exchanges and the
+combatants in each of them. Every exchange is resolved against the
+snapshot of its pair from the start of the turn: wounds and positioning
+are only queued up on their states (see CombatantState.settle). Once
+every exchange is resolved, merge goes through the combatants once
+each, in id order, settling everything their exchanges queued up and
+running apply_status and check_special_status for them a single time,
+going by how they did in their own exchange, the one with whoever
+they're attacking.
+"""
+from game.gamesrc.combat import positional
+
+# {role: the win condition apply_status goes by}
+ROLE_WIN_TYPES = {"win": "win", "both": "win", "lose": "lose",
+                  "null": "null"}
+
+class ExchangeSchedule(object):
+    """
+    self.exchanges (list) - (p_one, p_two) of every exchange, in order
+    self.involved (dict) - {dbref: indexes of the exchanges they're in}
+    self.primary (dict) - {dbref: index of their own exchange, the one
+                          with their target, or failing that their first}
+    self.roles (dict) - {dbref: their role in their own exchange (see
+                        positional.OUTCOME_ROLES), once it's resolved}
+    """
+    def __init__(self, parsed_pairs, graph=None):
+        self.exchanges = list(parsed_pairs)
+        self.involved = {}
+        self.primary = {}
+        self.roles = {}
+        for (index, (p_one, p_two)) in enumerate(self.exchanges):
+            for (char, other) in ((p_one, p_two), (p_two, p_one)):
+                self.involved.setdefault(char.id, []).append(index)
+                if graph is not None and graph.is_attacking(char, other):
+                    self.primary[char.id] = index
+                else:
+                    self.primary.setdefault(char.id, index)
+
+    def record(self, index, winner):
+        """
+        Notes how the exchange went, for whichever of its pair it's
+        their own exchange.
+        """
+        (p_one, p_two) = self.exchanges[index]
+        (role_one, role_two) = positional.OUTCOME_ROLES[winner]
+        if self.primary[p_one.id] == index:
+            self.roles[p_one.id] = role_one
+        if self.primary[p_two.id] == index:
+            self.roles[p_two.id] = role_two
+
+    def merge(self, states, combat_handler):
+        """
+        Settles every combatant whose exchanges have been recorded, in
+        id order, and runs their end of turn status checks once.
+        """
+        # resolve_combat imports us, so we can only import it once we're loaded
+        from game.gamesrc.combat import resolve_combat
+        for dbref in sorted(self.roles):
+            char_state = states[dbref]
+            role = self.roles[dbref]
+            resolve_combat.apply_status(char_state, ROLE_WIN_TYPES[role])
+            char_state.settle()
+            if role == "win":
+                resolve_combat.check_special_status(char_state,
+                                                    combat_handler, True)
+            else:
+                resolve_combat.check_special_status(char_state,
+                                                    combat_handler)
+        self.roles = {}
@@ -1,16 +1,36 @@
-from ev import create_script
-from ev import search_script
 from ev import Script
-from ev import logger
+from game.gamesrc.combat import battleground
 from game.gamesrc.combat import move
 from game.gamesrc.combat import resolve_combat
 from game.gamesrc.combat import combo
-import random
+from game.gamesrc.combat import commit
+from game.gamesrc.combat import effect_timers
+from game.gamesrc.combat import modifiers
+from game.gamesrc.combat import pair_graph
+from game.gamesrc.combat import registry
+from game.gamesrc.combat import replay
+from game.gamesrc.combat import rng as combat_rng
+from game.gamesrc.combat import round_scheduler
+from game.gamesrc.combat import stances
+from game.gamesrc.combat import tracing
 
 COMBAT_ROUND_TIMEOUT = 40
+# when a round is resolved early, once the handler isn't waiting on
+# anyone's input any more (see CombatHandler.mark_ready):
+#   READY_ALL - as soon as everyone has put in a move
+#   READY_GRACE - READY_GRACE_WINDOW seconds after everyone has, so they
+#                 can still change their minds
+#   READY_PLAYERS - as soon as every player has, NPCs never hold it up
+READY_ALL = "all"
+READY_GRACE = "grace"
+READY_PLAYERS = "players"
+READY_POLICY = READY_ALL
+READY_GRACE_WINDOW = 5
 ROOM_DEPTH = 3
-STATUS_STORAGE = search_script("StatusStorage")
-STATUS_STORAGE = STATUS_STORAGE[0]
+# how many exits away the battleground goes, which the old recursion
+# on ROOM_DEPTH took out to ROOM_DEPTH + 2
+BATTLEGROUND_DEPTH = ROOM_DEPTH + 2
+STATUS_STORAGE = registry.find_script("StatusStorage")
 
 class CombatHandler(Script):
     """
@@ -19,13 +39,10 @@ class CombatHandler(Script):
     # standard Script hooks 
     def at_script_creation(self):
         # Called when script is first created
-        random_key = "combat_handler_%i" % random.randint(1, 1000)
-        while search_script(random_key):
-            random_key = "combat_handler_%i" % random.randint(1, 1000)
-        self.key = random_key
+        self.key = registry.allocate_key()
         self.desc = "handles combat"
-        self.interval = COMBAT_ROUND_TIMEOUT
-        self.start_delay = True
+        # rounds are run by the shared round scheduler rather than an
+        # interval of our own, see at_start
         self.persistent = True   
         self.db.origin_location = None
         self.db.rooms = []
@@ -61,28 +78,15 @@ class CombatHandler(Script):
         character.stop_bleed()
         # remove healing tick
         character.stop_heal()
-        # we essentially delete all status effects on the player at
-        # the start of combat and reinitialize them without an actual 
-        # interval, so we force_repeat them manually at the end of each round. 
-        # We restore all status effects as well when combat ends,
-        # with their proper intervals and repeats.
+        # we pause all status effects on the player at the start of
+        # combat, and run their repeats ourselves at the end of each
+        # round. We restore all status effects as well when combat ends,
+        # with their proper intervals and repeats. See effect_timers.py.
         try:
-            scripts = character.scripts.all()
-            for script in scripts:
-                if script.db.is_status_effect:
-                    repeats = script.remaining_repeats()
-                    next_repeat = script.time_until_next_repeat()
-                    script.stop()
-                    if repeats > 1:
-                        create_script(script, obj=character,
-                            repeats=repeats, interval=COMBAT_ROUND_TIMEOUT)
-                    # if there was more than 15 seconds remaining 
-                    # on the tick, we add it again with a single repeat
-                    elif next_repeat > 15:
-                        create_script(script, obj=character,
-                            repeats=1, interval=COMBAT_ROUND_TIMEOUT)
+            effect_timers.start_combat(character, COMBAT_ROUND_TIMEOUT)
         except:
             pass
+        modifiers.reset_eff_multipliers(character)
 
     def _cleanup_character(self, character):
         # Remove character from handler and clean it 
@@ -91,6 +95,7 @@ class CombatHandler(Script):
         character.cmdset.delete("CmdSetCombat")
         if character in self.db.pairs.keys():
             del self.db.pairs[character]
+        self.get_pair_graph().drop_target(character)
         if dbref in self.db.turn_actions.keys():
             del self.db.turn_actions[dbref]
         if dbref in self.db.turn_combos.keys():
@@ -99,9 +104,13 @@ class CombatHandler(Script):
             del self.db.turn_effects[dbref]
         if dbref in self.db.characters.keys():
             del self.db.characters[dbref]
+        registry.remove_participant(self, character)
+        # nobody waits on them any more
+        self.mark_ready(character)
         del character.ndb.combat_handler
         if character.ndb.pos:
             del character.ndb.pos
+        modifiers.clear_modifiers(character)
         # add bleeding tick if they're bleeding
         try:
             for wound in character.db.wounds:
@@ -112,21 +121,13 @@ class CombatHandler(Script):
             pass
         # add healing tick
         character.start_heal()
-        # we unpause all status effects and let them run normally. codedly,
-        # this means removing all of the status effects on the character,
-        # then reinitializing them with the standard interval, 
-        # with repeats intact.
+        # we unpause all status effects and let them run normally,
+        # with the repeats they have left.
         try:
-            for script in character.scripts.all():
-                if script.db.is_status_effect:
-                    next_repeat_sec = script.time_until_next_repeat()
-                    repeats = script.remaining_repeats()
-                    script.stop()
-                    if repeats > 1 and next_repeat_sec > 20:
-                        create_script(script, obj=character, 
-                            repeats=repeats, interval=30)
+            effect_timers.end_combat(character)
         except:
             pass
+        modifiers.reset_eff_multipliers(character)
 
     def at_start(self):
         """
@@ -136,13 +137,16 @@ class CombatHandler(Script):
         """
         for character in self.db.characters.values():
             self._init_character(character)
+        registry.register(self)
+        round_scheduler.schedule(self, COMBAT_ROUND_TIMEOUT)
         #self.combat_state()
 
     def at_stop(self):
         """
         Called just before the script is stopped/destroyed.
         """
-        logger.log_infomsg("stopping the combat handler.")
+        tracing.trace("handler", tracing.INFO, "Stopping %s.", self.key)
+        round_scheduler.cancel(self)
         if any(self.db.characters):
             try:
                 for character in list(self.db.characters.values()):
@@ -151,32 +155,69 @@ class CombatHandler(Script):
                     self._cleanup_character(character)
             except:
                 pass
+        registry.unregister(self)
 
     def at_repeat(self):
         """
-        This is called every self.interval seconds or when force_repeat 
-        is called (because everyone has entered their commands).
+        Runs the round by itself, when force_repeat is called. Rounds
+        are normally run by the round scheduler (see round_scheduler.py)
+        every COMBAT_ROUND_TIMEOUT seconds, together with any other
+        handler's round that's due at the same time, through start_turn,
+        resolve_round and finish_turn.
+        """
+        self.start_turn()
+        self.end_turn()
+
+    def start_turn(self):
+        """
+        Gets the turn ready to be resolved.
         """
         # set all combos that are empty to the dummy combo value
         for (dbref, char_combo) in self.db.turn_combos.items():
             if not char_combo:
                 self.db.turn_combos[dbref] = combo.Dummy()
+        # everything random from here on comes from the turn's stream,
+        # so the turn can be replayed from its seed
+        turn_seed = self.get_rng().start_turn()
+        tracing.trace("handler", tracing.INFO, "%s turn seed: %s", self.key,
+                      turn_seed)
         self.process_stances()
         # hook in AI move stuff here
-        self.end_turn()
         #self.combat_state()
 
     # Combat-handler methods
+    def get_rng(self):
+        """
+        Returns the handler's rng.CombatRNG, starting one if it doesn't
+        have one yet (such as after a reload).
+        """
+        if not self.ndb.rng:
+            self.ndb.rng = combat_rng.CombatRNG()
+        return self.ndb.rng
+
+    def get_turn_log(self):
+        """
+        Returns the handler's replay.TurnLog of its recent turns,
+        starting one if it doesn't have one yet.
+        """
+        if not self.ndb.turn_log:
+            self.ndb.turn_log = replay.TurnLog(
+                path=replay.log_path("combat_handler_%s" % self.id))
+        return self.ndb.turn_log
+
     def add_character(self, character, target):
         # Add combatant to handler"
         dbref = character.id
         self.db.characters[dbref] = character
         self.db.pairs[character] = target
+        self.get_pair_graph().set_target(character, target)
         # move, combo, previous_move        
         self.db.turn_actions[dbref] = {"move":None, "previous_move":None}
         self.db.turn_combos[dbref] = None
         self.db.turn_effects[dbref] = {}
         self._init_character(character)
+        registry.add_participant(self, character)
+        self.mark_waiting(character)
 
     def remove_character(self, character):
         # Remove combatant from handler"
@@ -205,55 +246,39 @@ class CombatHandler(Script):
 
     def combat_state(self):
         """
-        This makes the surrounding area with a 3-depth recursion in all
-        directions (using the exit) a "battleground", which means that
+        This makes the surrounding area, up to BATTLEGROUND_DEPTH exits
+        away in all directions, a "battleground", which means that
         standard movement is delayed in time with the round pulse.
+        Past the rooms right next to us, only standard cardinal exits
+        are gone through. The battleground is shared with any other
+        fight in the same room, see battleground.py.
 
         TO DO: Add in a script to the affected rooms to prevent certain
         commands from being done.
         """
         # make the surrounding area a battleground
-        exits = (con for con in self.db.origin_location.contents
-                 if con.destination)
-        for exit in exits:
-            if self.db.origin_location not in self.db.rooms:
-                self.db.rooms.append(self.db.origin_location)
-            if exit not in self.db.exits:
-                self.db.exits.append(exit)
-            exit.ndb.combat_handler = self
-            self.recurse_room_state(exit, ROOM_DEPTH)
-
-    def recurse_room_state(self, exit, count):
-        """
-        Our actual recursion for the combat_state, which will keep
-        calling the function until the count is 0. Default recursion
-        is 3, for a 3-depth recursion on all exits in every directions
-        that's a standard cardinal direction. Non-standard exits do not
-        recurse.
-        """
-
-        exits = (con for con in exit.destination.contents if con.destination)
-        for exit in exits:
-            if exit not in self.db.exits:
-                self.db.exits.append(exit)
-            if exit.destination not in self.db.rooms:
-                self.db.rooms.append(exit.destination)
+        area = battleground.get_battleground(self.db.origin_location,
+                                             BATTLEGROUND_DEPTH)
+        self.db.rooms = list(area.rooms)
+        self.db.exits = list(area.exits)
+        for exit in area.exits:
             exit.ndb.combat_handler = self
-            # if the exit isn't a standard exit name, the recursion
-            # ends here
-            if exit.key not in \
-                ("north", "east", "south", "west", "up", "down"):
-                return
-            # as long as the count is greater than 0, then
-            # we recursively call the function again on the exit
-            # to branch out and make more exits part of our
-            # "battleground"
-            if count > 0:
-                self.recurse_room_state(exit, count - 1)
+        registry.index_rooms(self)
 
     def get_opponent(self, character):
         return self.db.pairs.get(character, None)
 
+    def get_pair_graph(self):
+        """
+        Returns the PairGraph that indexes self.db.pairs, building it
+        from self.db.pairs the first time it's needed after a reload.
+        Anything that changes self.db.pairs must update it as well.
+        """
+        if self.ndb.pair_graph is None:
+            self.ndb.pair_graph = \
+                pair_graph.PairGraph.from_pairs(self.db.pairs)
+        return self.ndb.pair_graph
+
     def add_action(self, character, action):
         """
         Called by combat commands to register an action with the handler.
@@ -270,6 +295,7 @@ class CombatHandler(Script):
         previous_move = self.db.turn_actions[dbref]["previous_move"]
         self.db.turn_actions[dbref]["move"] = action
         self.db.turn_actions[dbref]["previous_move"] =  previous_move
+        self.mark_ready(character)
 
     def add_combo(self, character, char_combo):
         """
@@ -285,6 +311,48 @@ class CombatHandler(Script):
         """
         dbref = character.id
         self.db.turn_combos[dbref] = char_combo
+        self.mark_ready(character)
+
+    def _blocks(self, character):
+        # whether the round waits on the character's input
+        return READY_POLICY != READY_PLAYERS or character.has_player
+
+    def get_waiting(self):
+        """
+        Returns the set of dbrefs of everyone the round is still waiting
+        on for input, working it out from self.db.turn_actions the first
+        time it's needed in a turn.
+        """
+        if self.ndb.waiting is None:
+            self.ndb.waiting = set(dbref for (dbref, character) in
+                self.db.characters.items() if self._blocks(character) and
+                not self.db.turn_actions[dbref]["move"] and
+                dbref not in self.db.shifting)
+        return self.ndb.waiting
+
+    def mark_waiting(self, character):
+        """
+        Makes the round wait on the character's input again.
+        """
+        if character.id in self.db.characters and self._blocks(character):
+            self.get_waiting().add(character.id)
+
+    def mark_ready(self, character):
+        """
+        Notes that the round isn't waiting on the character any more, and
+        once it isn't waiting on anyone, has it resolved early as
+        READY_POLICY says.
+        """
+        waiting = self.get_waiting()
+        waiting.discard(character.id)
+        if waiting:
+            return
+        tracing.trace("handler", tracing.DEBUG, "Everyone in %s is ready.",
+                      self.key)
+        if READY_POLICY == READY_GRACE:
+            round_scheduler.expedite(self, READY_GRACE_WINDOW)
+        else:
+            round_scheduler.expedite(self)
 
     def add_shifting_char(self, char, new_target):
         """
@@ -294,16 +362,18 @@ class CombatHandler(Script):
         dbref = char.id
         self.db.shifting[dbref] = new_target
         char.scripts.add("game.gamesrc.scripts.status_effects.ShiftTarget")
+        # they give up their turn to shift, so there's nothing to wait on
+        self.mark_ready(char)
 
     def switch_target(self, char, new_target):
         """
         Switches the character's previous target with the
         new target. It deletes the dbref in the shifting dict as well.
         """
-        dbref = char.id
-        del_shifting_char(char)
+        self.del_shifting_char(char)
         del self.db.pairs[char]
         self.db.pairs[char] = new_target
+        self.get_pair_graph().set_target(char, new_target)
 
     def del_shifting_char(self, char):
         """
@@ -311,6 +381,7 @@ class CombatHandler(Script):
         as when a player stops trying to shift targets or when they
         successfully do so.
         """
+        dbref = char.id
         if self.db.shifting[dbref]:
             del self.db.shifting[dbref]
         char.scripts.stop("game.gamesrc.scripts.status_effects.ShiftTarget")
@@ -341,11 +412,10 @@ class CombatHandler(Script):
         """
         Add status effect to the combat handler to add at the end of the turn.
         """
-        logger.log_infomsg("Calling the status effect function.")
         dbref = char.id
         self.db.turn_effects[dbref][status_effect] = repeats
-        logger.log_infomsg("The turn_effect dict is now %s for %s" %\
-            (self.db.turn_effects[dbref], char.db.sdesc))
+        tracing.trace("effects", tracing.DEBUG, "%s queued on #%s for %s",
+                      status_effect, dbref, repeats)
 
     def del_flee_char(self, char):
         """
@@ -376,9 +446,10 @@ class CombatHandler(Script):
         # get the attacker and then delete who they're attacking
         # in combat
         attacker = self.db.pairs[tgt]
-        del combat_handler.db.pairs[attacker]
+        del self.db.pairs[attacker]
         # make their new target our rescue-er
-        combat_handler.db.pairs[attacker] = char
+        self.db.pairs[attacker] = char
+        self.get_pair_graph().set_target(attacker, char)
         # process and delete the rescue attempt from our handler
         self.del_rescue(char)
 
@@ -400,6 +471,7 @@ class CombatHandler(Script):
         self.db.turn_actions[dbref] = {"move":None, 
             "previous_move": previous_move}
         self.db.turn_combos[dbref] = None
+        self.mark_waiting(char)
 
     def add_stop_request(self, character, target):
         """
@@ -430,15 +502,6 @@ class CombatHandler(Script):
                     stance, banned_moves, tgt)
                 self.db.turn_actions[dbref]["move"] = chosen_move
 
-    # stance rules, in the form of {stance:{tgt_move:banned_move}}
-    # so we check the target move, if it matches up, then we ban 
-    # banned_move from our available moves list.
-    STANCE_RULES = {
-    "offensive": {move.thrust: move.riposte, 
-    move.high_parry: move.slash, move.low_parry: move.slash},
-    "defensive": {move.high_cut: move.duck, move.low_cut: move.low_parry, 
-    move.high_cut: move.high_parry, move.thrust:move.dodge}}
-
     def stance_chooser(self, character, chosen_stance, banned_moves, target):
         """
         Chooses a move based on the given stance, and the banned moves.
@@ -456,66 +519,14 @@ class CombatHandler(Script):
         * balanced knows both
         * randomizer always kicks in for status effects, stances don't matter
          when you're status effect'd up
+
+        The moves each of these can pick from are compiled into tables
+        (see stances.StanceTables), so this is a lookup and one draw.
         """
-        # if it ever returns that all moves are banned, naturally we pass.
-        # there's nothing our stance AI can do.
-        if banned_moves == "all":
-            return move.pass_turn
         previous_move = self.db.turn_actions[character.id]["previous_move"]
-        # classic moves will be the holder for all moves our character
-        # can actually do
-        classic_moves = move.CLASSIC_MATRIX[:]
-        # remove our previous move from the list of available moves
-        if previous_move and previous_move != move.pass_turn:
-            classic_moves.remove(previous_move)
-        # if banned moves existed, that means we had status effects
-        # that banned out moves. If this is the case, we totally
-        # randomize our move selection.
-        if banned_moves:
-            for banned_move in banned_moves:
-                if banned_move in classic_moves:
-                    classic_moves.remove(banned_move)
-            if classic_moves:
-                random_move = random.choice(classic_moves)
-                return random_move
-            else:
-                return move.pass_turn
-        # grab our previous move that our target did
         tgt_move = self.db.turn_actions[target.id]["previous_move"]
-        if not tgt_move:
-            tgt_move = move.pass_turn
-        # it's time to get rid of any moves that don't meet the criteria
-        # of any of our stances. That means that for offensive/defensive,
-        # they only perform offensive/defensive moves, so it makes sense
-        # to get rid of all of our available offensive/defensive moves.
-        if chosen_stance == "offensive":
-            for c_move in list(classic_moves):
-                if c_move.move_type == "defensive":
-                    classic_moves.remove(c_move)
-            for (t_move, ban_move) in self.STANCE_RULES["offensive"].items():
-                if t_move == tgt_move and ban_move in classic_moves:
-                    classic_moves.remove(ban_move)
-            return random.choice(classic_moves)
-        if chosen_stance == "defensive":
-            for c_move in list(classic_moves):
-                if c_move.move_type == "offensive":
-                    classic_moves.remove(c_move)
-            for (t_move, ban_move) in self.STANCE_RULES["defensive"].items():
-                if t_move == tgt_move and ban_move in classic_moves:
-                    classic_moves.remove(ban_move)
-            return random.choice(classic_moves)
-        # if the stance was neither defensive nor offensive,
-        # because it was 'balanced' or it wasn't found,
-        # then we use balanced by default
-        else:
-            # balanced knows both rules of offensive/defensive
-            for (t_move, ban_move) in self.STANCE_RULES["offensive"].items():
-                if t_move == tgt_move and ban_move in classic_moves:
-                    classic_moves.remove(ban_move)
-            for (t_move, ban_move) in self.STANCE_RULES["defensive"].items():
-                if t_move == tgt_move and ban_move in classic_moves:
-                    classic_moves.remove(ban_move)
-            return random.choice(classic_moves)
+        return stances.choose(self.get_rng(), chosen_stance, previous_move,
+                              tgt_move, banned_moves)
 
     def find_banned_moves(self, character):
         """
@@ -542,6 +553,7 @@ class CombatHandler(Script):
         shift targets to one of the characters still attacking them.
         """
         stop_requests = dict(self.db.stop_requests)
+        graph = self.get_pair_graph()
         stops = {}
         for (att, tgt) in stop_requests.items():
             # if a stop request matches with the other, then we have a pair
@@ -551,12 +563,10 @@ class CombatHandler(Script):
                 stop_requests[tgt].id == att.id) and\
             (tgt not in stops.values() or att not in stops.values()):
                 # check who's still attacking our pair
-                att_attackers = [target for (attacker, target)
-                    in self.db.pairs.items() if target.id == att.id and
-                    attacker.id != tgt.id]
-                tgt_attackers = [target for (attacker, target)
-                    in self.db.pairs.items() if target.id == tgt.id and
-                    attacker.id != att.id]
+                att_attackers = [attacker for attacker
+                    in graph.attackers_of(att) if attacker.id != tgt.id]
+                tgt_attackers = [attacker for attacker
+                    in graph.attackers_of(tgt) if attacker.id != att.id]
                 # add these guys to our stop dict, just so we don't 
                 # do it twice per pair as we iterate
                 stops[att] = tgt
@@ -568,7 +578,7 @@ class CombatHandler(Script):
                 # If they aren't being attacked by anyone else, 
                 # then withdraw them from combat. 
                 if att_attackers:
-                    new_tgt = random.choice(att_attackers)
+                    new_tgt = self.get_rng().choice(att_attackers)
                     att.msg("You are still being attacked," + 
                         " and you turn your attention to {M%s{n!" % \
                             (new_tgt.db.sdesc))
@@ -577,6 +587,7 @@ class CombatHandler(Script):
                         "as they disengage in combat with {M%s{n." % \
                             (tgt.db.sdesc))
                     self.db.pairs[att] = new_tgt
+                    graph.set_target(att, new_tgt)
                 else:
                     att.msg("No one else is attacking you, and" +
                              " you withdraw from combat.")
@@ -586,7 +597,7 @@ class CombatHandler(Script):
                             (tgt.db.sdesc), exclude=att)
                     self.remove_character(att)
                 if tgt_attackers:
-                    new_tgt = random.choice(tgt_attackers)
+                    new_tgt = self.get_rng().choice(tgt_attackers)
                     tgt.msg("You are still being attacked," + 
                             " and you turn your attention to {M%s{n!" % \
                             (new_tgt.db.sdesc))
@@ -595,6 +606,7 @@ class CombatHandler(Script):
                         "in combat with {M%s{n." % \
                                     (att.db.sdesc))
                     self.db.pairs[tgt] = new_tgt
+                    graph.set_target(tgt, new_tgt)
                 else:
                     tgt.msg("No one else is attacking you," + 
                                 " and you withdraw from combat.")
@@ -606,27 +618,18 @@ class CombatHandler(Script):
 
     def at_add_status_tick(self):
         """
-        Combat tick for the turn. Adds any pending status effects.
+        Combat tick for the turn. Runs a repeat of everyone's status
+        effects, then adds any pending status effects.
         """
         for character in self.db.characters.values():
             dbref = character.id
+            effect_timers.round_tick(character)
             if self.db.turn_effects[dbref]:
                 for (effect, duration) in self.db.turn_effects[dbref].items():
-                    exist = None
-                    repeats = 0
-                    exist = character.scripts.get(effect)
-                    if exist:
-                        if exist.remaining_repeats():
-                            repeats = exist.remaining_repeats()
-                        exist.db.quiet_mode = True
-                        exist.stop()
-                    if duration:
-                        create_script(STATUS_STORAGE.get_effect(effect),
-                         obj=character, interval=COMBAT_ROUND_TIMEOUT, 
-                         repeats=(duration + repeats))
-                    else:
-                        create_script(STATUS_STORAGE.get_effect(effect), 
-                        obj=character, interval=COMBAT_ROUND_TIMEOUT)
+                    effect_timers.add_effect(character, effect,
+                        STATUS_STORAGE.get_effect(effect), duration,
+                        COMBAT_ROUND_TIMEOUT)
+                modifiers.reset_eff_multipliers(character)
 
     def at_bleed_tick(self):
         """
@@ -640,17 +643,77 @@ class CombatHandler(Script):
         This resolves all actions by calling the rules module. 
         It then resets everything and starts the next turn.
         """
+        self.snapshot_modifiers()
+        # wounds, health and positioning are buffered for the turn and
+        # written once per character, before anyone sees their prompt
+        turn_commit = commit.CombatCommit()
+        self.resolve_round(turn_commit)
+        turn_commit.flush()
+        self.finish_turn()
+
+    def snapshot_modifiers(self):
+        """
+        Snapshots everyone's status effect/trait modifiers once for the
+        turn, so the resolver doesn't have to rescan scripts for every
+        lookup.
+        """
+        modifiers.snapshot_modifiers(self.db.characters,
+            self.db.turn_actions, self.db.turn_combos)
+
+    def roll_round(self, pool_batch):
+        """
+        Rolls the turn's damage in the process pool, along with every
+        other round in pool_batch (a parallel.PoolBatch), once everyone's
+        modifiers have been snapshotted. The turn is kept on
+        self.ndb.prepared_turn for resolve_round, which can only be
+        called once the batch has been waited on.
+        """
+        self.ndb.prepared_turn = None
         self.at_bleed_tick()
         self.process_stop_requests()
+        self.ndb.prepared_turn = resolve_combat.prepare_combat(
+            self.db.characters, self.db.turn_actions, self.db.turn_combos,
+            self, self.get_rng(), self.get_turn_log(), pool_batch)
+
+    def resolve_round(self, turn_commit):
+        """
+        Resolves the turn into turn_commit, once everyone's modifiers
+        have been snapshotted. It's up to the caller to flush it.
+        """
+        prepared = self.ndb.prepared_turn
+        if prepared is None:
+            self.at_bleed_tick()
+            self.process_stop_requests()
+        self.ndb.prepared_turn = None
         resolve_combat.resolve_combat(self.db.characters,
-            self.db.turn_actions, self.db.turn_combos, self.db.pairs, self)
+            self.db.turn_actions, self.db.turn_combos, self.db.pairs, self,
+            turn_commit, self.get_rng(), self.get_turn_log(), prepared)
+
+    def finish_turn(self):
+        """
+        Once the turn is resolved and committed, shows everyone their
+        prompt and starts the next turn.
+        """
+        # send them an empty message so they see the prompt
+        self.msg_all("")
         # reset counters before next turn
         self.at_add_status_tick()
+        # build the new turn's dicts and store each of them once, rather
+        # than saving them again for every character
+        turn_actions = dict(self.db.turn_actions)
+        turn_combos = dict(self.db.turn_combos)
+        turn_effects = dict(self.db.turn_effects)
         for (dbref, character) in self.db.characters.items():
             # 0 is the index for the character's move
-            previous_move = self.db.turn_actions[dbref]["move"]
-            self.db.turn_actions[dbref] = {"move":None, 
+            previous_move = turn_actions[dbref]["move"]
+            turn_actions[dbref] = {"move":None, 
                 "previous_move":previous_move}
-            self.db.turn_combos[dbref] = None
-            self.db.turn_effects[dbref] = {}
-        logger.log_infomsg("End turn.")
\ No newline at end of file
+            turn_combos[dbref] = None
+            turn_effects[dbref] = {}
+            modifiers.clear_modifiers(character)
+        self.db.turn_actions = turn_actions
+        self.db.turn_combos = turn_combos
+        self.db.turn_effects = turn_effects
+        # worked out again for the new turn
+        self.ndb.waiting = None
+        tracing.trace("handler", tracing.DEBUG, "End of %s's turn.", self.key)
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Compiled decision tables for the stance AI.
+
+Anyone who hasn't chosen a move by the end of the turn gets one picked
+for them by their stance (see CombatHandler.process_stances). The
+stance chooser used to copy move.CLASSIC_MATRIX, list.remove their
+previous move and anything banned from it, and go through the stance's
+rules and every move's move_type, for every idle combatant every turn.
+
+What it can pick only ever depends on the stance, the combatant's
+previous move, their target's previous move and which moves are banned,
+so each of those is worked out once here, as a tuple of the moves it
+can pick from in CLASSIC_MATRIX order, keyed by
+
+    (stance, own previous move, target's previous move, banned mask)
+
+where moves are keyed by name and the banned mask has a bit set for
+every move of CLASSIC_MATRIX that's banned (and BANNED_OTHER for any
+other move). Every entry with nothing banned is compiled up front; ones
+with something banned are compiled the first time they come up.
+Choosing a move is then a lookup and a single draw from the turn's rng.
+"""
+from game.gamesrc.combat import move
+
+BALANCED = "balanced"
+# {stance: the only move_type it picks from, None for any}
+STANCE_TYPES = {"offensive": "offensive", "defensive": "defensive",
+                BALANCED: None}
+# stance rules, in the form of {stance: {tgt_move: banned_moves}}
+# so if our target's previous move was tgt_move, we never pick any of
+# banned_moves. Balanced knows the rules of both.
+STANCE_RULES = {
+    "offensive": {move.thrust: (move.riposte,),
+                  move.high_parry: (move.slash,),
+                  move.low_parry: (move.slash,)},
+    "defensive": {move.high_cut: (move.duck, move.high_parry),
+                  move.low_cut: (move.low_parry,),
+                  move.thrust: (move.dodge,)}}
+
+# {move name: its bit in a banned mask}
+MOVE_BITS = dict((c_move.name, 1 << index)
+                 for (index, c_move) in enumerate(move.CLASSIC_MATRIX))
+# set in a banned mask when something outside of CLASSIC_MATRIX is banned
+BANNED_OTHER = 1 << len(move.CLASSIC_MATRIX)
+# every previous move anyone can have, pass standing in for none
+PREVIOUS_NAMES = [move.pass_turn.name] + \
+    [c_move.name for c_move in move.CLASSIC_MATRIX]
+
+def banned_mask(banned_moves):
+    """
+    Returns the banned mask of a list of banned moves. Banned moves
+    outside of CLASSIC_MATRIX are never picked anyway, but still count
+    as something being banned.
+    """
+    mask = 0
+    for banned_move in banned_moves:
+        mask |= MOVE_BITS.get(banned_move.name, BANNED_OTHER)
+    return mask
+
+def _rules_for(stance):
+    # {tgt_move name: names of the moves banned after it}
+    if stance in STANCE_RULES:
+        stances = [stance]
+    else:
+        stances = list(STANCE_RULES)
+    rules = {}
+    for rule_stance in stances:
+        for (t_move, ban_moves) in STANCE_RULES[rule_stance].items():
+            rules.setdefault(t_move.name, set()).update(
+                ban_move.name for ban_move in ban_moves)
+    return rules
+
+def compile_candidates(stance, previous_name, tgt_name, mask):
+    """
+    Works out the moves the stance AI can pick from. Anyone with banned
+    moves is picked for at random, whatever their stance, from every
+    move that isn't banned; otherwise their stance and their target's
+    previous move narrow it down. Either way, nobody picks the move they
+    did last turn.
+    """
+    candidates = [c_move for c_move in move.CLASSIC_MATRIX
+                  if c_move.name != previous_name]
+    if mask:
+        return tuple(c_move for c_move in candidates
+                     if not mask & MOVE_BITS[c_move.name])
+    move_type = STANCE_TYPES.get(stance)
+    banned = _rules_for(stance).get(tgt_name, ())
+    return tuple(c_move for c_move in candidates
+                 if (move_type is None or c_move.move_type == move_type)
+                 and c_move.name not in banned)
+
+class StanceTables(object):
+    """
+    self.table (dict) - {(stance, previous move name, target's previous
+                        move name, banned mask): candidate moves}
+    """
+    def __init__(self):
+        self.table = {}
+        for stance in STANCE_TYPES:
+            for previous_name in PREVIOUS_NAMES:
+                for tgt_name in PREVIOUS_NAMES:
+                    key = (stance, previous_name, tgt_name, 0)
+                    self.table[key] = compile_candidates(*key)
+
+    def candidates(self, stance, previous_move, tgt_move, mask):
+        """
+        Returns the moves the stance AI can pick from, as a tuple.
+        """
+        if not previous_move:
+            previous_move = move.pass_turn
+        if not tgt_move:
+            tgt_move = move.pass_turn
+        key = (stance, previous_move.name, tgt_move.name, mask)
+        found = self.table.get(key)
+        if found is None:
+            found = compile_candidates(*key)
+            self.table[key] = found
+        return found
+
+    def choose(self, rng, stance, previous_move, tgt_move, banned_moves):
+        """
+        Picks a move for someone who didn't choose one, from rng.
+        banned_moves is a list of the moves they can't do, or "all".
+        """
+        # if it ever returns that all moves are banned, naturally we pass.
+        # there's nothing our stance AI can do.
+        if banned_moves == "all":
+            return move.pass_turn
+        mask = 0
+        if banned_moves:
+            mask = banned_mask(banned_moves)
+        found = self.candidates(stance, previous_move, tgt_move, mask)
+        if not found:
+            return move.pass_turn
+        return rng.choice(found)
+
+STANCE_TABLES = StanceTables()
+
+def choose(rng, stance, previous_move, tgt_move, banned_moves):
+    """
+    See StanceTables.choose.
+    """
+    return STANCE_TABLES.choose(rng, stance, previous_move, tgt_move,
+                                banned_moves)
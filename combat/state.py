@@ -0,0 +1,342 @@
+"""
+Pure-data snapshots of combatants for resolving a turn.
+
+Every attribute read off a typeclass (char.db.wielding, vict.db.body,
+vict.db.equipped, char.ndb.pos ...) goes through the attribute handler,
+and most of them unpickle. resolve_combat builds one CombatantState per
+combatant at the start of the turn, resolves everything against those,
+and writes the results back to the characters in one commit step at
+the end, through a commit.CombatCommit. Since a state is plain data,
+the resolver can also be run and benchmarked against hand-built states
+without a server.
+"""
+from game.gamesrc.combat.objects import armor
+from game.gamesrc.combat import commit
+from game.gamesrc.combat import hit_locations
+from game.gamesrc.combat import modifiers
+from game.gamesrc.combat import render
+
+# positioning limits, same as Character.set_pos
+MIN_POS = commit.MIN_POS
+MAX_POS = commit.MAX_POS
+
+# weapons that can break another with the break combo
+BREAKER_TYPECLASSES = ("game.gamesrc.combat.objects.weapons.Axe",
+                       "game.gamesrc.combat.objects.weapons.Mace",
+                       "game.gamesrc.combat.objects.weapons.Greatsword")
+
+class WeaponState(object):
+    """
+    The parts of a wielded weapon or shield that combat cares about.
+
+    self.obj - the weapon/shield object itself, for output and breaking
+    self.is_shield (boolean) - whether it's a shield rather than a weapon
+    self.move_wrapper (render.WrapperIndex) - its move wrapper, indexed
+    self.can_break (boolean) - whether it can break another with the
+                               break combo
+    """
+    __slots__ = ("obj", "id", "damage", "damage_bonus", "quality",
+                 "crit_chance", "dmg_type", "hands", "trait", "pos_mods",
+                 "broken", "weapon_type", "move_wrapper", "is_shield",
+                 "size", "breakable", "can_break")
+
+    def __init__(self, obj, is_shield=False):
+        db = obj.db
+        self.obj = obj
+        self.id = obj.id
+        self.damage = db.damage
+        self.damage_bonus = db.damage_bonus
+        self.quality = db.quality
+        self.crit_chance = db.crit_chance
+        self.dmg_type = db.dmg_type
+        self.hands = db.hands
+        self.trait = db.trait
+        self.pos_mods = db.pos_mods
+        self.broken = db.broken
+        self.weapon_type = db.weapon_type
+        self.move_wrapper = render.WrapperIndex(db.move_wrapper)
+        self.is_shield = is_shield
+        self.size = db.size
+        self.breakable = db.breakable
+        self.can_break = any(obj.is_typeclass(typeclass)
+                             for typeclass in BREAKER_TYPECLASSES)
+
+    def detach(self, index):
+        """
+        Returns a copy with the object swapped out for its index in the
+        wielder's weapons, safe to send to another process.
+        """
+        detached = WeaponState.__new__(WeaponState)
+        for slot in self.__slots__:
+            setattr(detached, slot, getattr(self, slot))
+        detached.obj = index
+        return detached
+
+class CombatantState(object):
+    """
+    Everything the resolver needs to know about a combatant for the
+    turn, read once, plus the changes the turn makes to them.
+
+    self.char - the character, for messaging and for committing
+    self.weapons (list) - WeaponStates for every wielded weapon that
+                          has damage, broken or not
+    self.shield (WeaponState) - the first unbroken shield wielded, or None
+    self.hit_index (hit_locations.BodyIndex) - what every move can hit
+                                              on their body
+    self.armor (tuple) - the character's armor mitigation vector, see
+                         armor.build_mitigation
+    self.script_keys (set) - keys of every script on the character, which
+                             covers traits and status effects
+    self.modifiers (ModifierSnapshot) - summed status effect/trait stats
+    self.eff_multipliers (EffectMultipliers) - summed effect multipliers
+    self.actor (render.Actor) - what goes into combat output about them
+    self.pos (int) - positioning, as of the start of the turn until the
+                     state is settled
+    self.health (int) - health, as of the start of the turn until the
+                        state is settled
+    self.pos_delta (int) - positioning the turn's exchanges have queued up
+    self.damage_taken (int) - damage the turn's wounds have queued up
+    self.wounds (list) - (location, damage, bleed, dmg_type) for every
+                         wound the turn inflicts, to be committed
+    self.heal_ticks (int) - forced heal ticks to run once the wounds are in
+    self.pos_inputs (positional.PositionInputs) - worked out on their first
+                                                  exchange
+    """
+    __slots__ = ("char", "id", "move", "combo", "weapons", "shield",
+                 "default_weapon", "body", "hit_index", "armor", "health",
+                 "max_health",
+                 "pos", "start_pos", "script_keys", "no_position",
+                 "modifiers", "eff_multipliers", "actor", "wounds",
+                 "heal_ticks", "pos_inputs", "pos_delta", "damage_taken")
+
+    def __init__(self, char, char_move, char_combo):
+        self.char = char
+        self.id = char.id
+        self.move = char_move
+        self.combo = char_combo
+        self.weapons = []
+        self.shield = None
+        for wielding in char.db.wielding.values():
+            if not wielding:
+                continue
+            if wielding.is_typeclass(
+                    "game.gamesrc.combat.objects.armor.Shield"):
+                if not self.shield and not wielding.db.broken:
+                    self.shield = WeaponState(wielding, True)
+            elif wielding.db.damage:
+                self.weapons.append(WeaponState(wielding))
+        self.default_weapon = dict(char.db.default_weapon)
+        self.body = list(char.db.body)
+        self.hit_index = hit_locations.get_index(self.body)
+        self.armor = armor.get_mitigation(char, self.body)
+        self.health = char.db.health
+        self.max_health = char.db.max_health
+        self.pos = char.ndb.pos or 0
+        self.start_pos = self.pos
+        scripts = char.scripts.all()
+        self.script_keys = set(script.key for script in scripts)
+        self.no_position = any(script.db.no_combat_position
+                               for script in scripts)
+        self.modifiers = char.ndb.modifiers
+        if not self.modifiers or not self.modifiers.covers("dam_gain",
+                "win", char_move, char_combo):
+            self.modifiers = modifiers.ModifierSnapshot(char, char_move,
+                                                        char_combo)
+        self.eff_multipliers = modifiers.get_eff_multipliers(char)
+        self.actor = render.Actor(char)
+        self.wounds = []
+        self.heal_ticks = 0
+        self.pos_inputs = None
+        self.pos_delta = 0
+        self.damage_taken = 0
+
+    def has_script(self, key):
+        """
+        Whether the character has a script (trait, status effect) by
+        this key.
+        """
+        return key in self.script_keys
+
+    def drop_script(self, key):
+        """
+        Forgets a script the combat handler has removed from the
+        character mid-turn, such as flee or rescue once processed.
+        """
+        self.script_keys.discard(key)
+
+    def has_trait(self, weapon):
+        """
+        Whether the character has the trait of the weapon or shield
+        (given as a WeaponState or the object itself).
+        """
+        if not weapon:
+            return False
+        if not isinstance(weapon, WeaponState):
+            weapon = self.find_weapon(weapon)
+            if not weapon:
+                return False
+        return bool(weapon.trait) and weapon.trait in self.script_keys
+
+    def find_weapon(self, obj):
+        """
+        Returns the WeaponState for the given weapon or shield object.
+        """
+        if obj is None:
+            return None
+        if self.shield and self.shield.obj == obj:
+            return self.shield
+        for weapon in self.weapons:
+            if weapon.obj == obj:
+                return weapon
+        return None
+
+    def weapon_index(self, obj):
+        """
+        Returns the index of the weapon in self.weapons, or None.
+        """
+        for (index, weapon) in enumerate(self.weapons):
+            if weapon.obj == obj:
+                return index
+        return None
+
+    def usable_weapons(self):
+        """
+        Every weapon the character can actually hit with this turn.
+        """
+        if self.has_script("disarmed"):
+            return []
+        return [weapon for weapon in self.weapons if not weapon.broken]
+
+    def stat(self, stat, win_cond):
+        """
+        Returns the summed status effect/trait stat for the win condition.
+        """
+        if self.modifiers.covers(stat, win_cond, self.move, self.combo):
+            return self.modifiers.get(stat, win_cond)
+        return modifiers.combat_stat(self.char, stat, win_cond, self.move,
+                                     self.combo)
+
+    def get_health_percent(self):
+        """
+        Current health percentage, as a float.
+        """
+        return (self.health * 1.0) / self.max_health
+
+    def add_wound(self, location=None, damage=0, bleed=0, dmg_type=None):
+        """
+        Queues a wound up to be committed. The damage comes off our
+        health when the state is settled.
+        """
+        self.wounds.append((location, damage, bleed, dmg_type))
+        self.damage_taken += damage
+
+    def set_pos(self, new_pos):
+        """
+        Sets positioning, within its limits.
+        """
+        self.pos = max(MIN_POS, min(MAX_POS, new_pos))
+
+    def shift_pos(self, delta):
+        """
+        Queues a change in positioning up, to be made when the state is
+        settled.
+        """
+        self.pos_delta += delta
+
+    def settle(self):
+        """
+        Makes every change to positioning and health the turn's
+        exchanges queued up, all at once, so that each of them was
+        resolved against the same snapshot of the combatant (see
+        scheduler.py).
+        """
+        self.set_pos(self.pos + self.pos_delta)
+        self.pos_delta = 0
+        self.health = min(self.health - self.damage_taken, self.max_health)
+        self.damage_taken = 0
+
+    def detach(self):
+        """
+        Returns a copy without the character or any typeclassed objects,
+        which can be pickled and resolved in another process (see
+        parallel.py) or kept for replay (see replay.py). Weapons stand in
+        for their objects with their index in self.weapons, the shield
+        with None, and the copy can't be committed.
+        """
+        detached = CombatantState.__new__(CombatantState)
+        for slot in self.__slots__:
+            setattr(detached, slot, getattr(self, slot))
+        detached.char = None
+        detached.weapons = [weapon.detach(index)
+                            for (index, weapon) in enumerate(self.weapons)]
+        if self.shield:
+            detached.shield = self.shield.detach(None)
+        detached.script_keys = set(self.script_keys)
+        detached.wounds = []
+        # keyed by the weapon objects, so worked out again for the copy
+        detached.pos_inputs = None
+        return detached
+
+    def with_action(self, char_move, char_combo):
+        """
+        Returns a copy of the state for trying out another move and
+        combo (see preview.py), with its modifiers rebuilt for them if
+        the snapshot can't answer for them.
+        """
+        copy = CombatantState.__new__(CombatantState)
+        for slot in self.__slots__:
+            setattr(copy, slot, getattr(self, slot))
+        copy.move = char_move
+        copy.combo = char_combo
+        copy.script_keys = set(self.script_keys)
+        copy.wounds = []
+        if self.char and not self.modifiers.covers("dam_gain", "win",
+                char_move, char_combo):
+            copy.modifiers = modifiers.ModifierSnapshot(self.char,
+                char_move, char_combo)
+        return copy
+
+    def commit(self, turn_commit):
+        """
+        Hands everything the turn changed to the turn's
+        commit.CombatCommit, to be written back to the character.
+        Positioning is only written if they're still in combat, since
+        it means nothing outside of it.
+        """
+        char = self.char
+        for wound in self.wounds:
+            turn_commit.add_wound(char, *wound)
+        self.wounds = []
+        for i in range(self.heal_ticks):
+            turn_commit.heal_tick(char)
+        self.heal_ticks = 0
+        if self.pos != self.start_pos and char.ndb.combat_handler:
+            turn_commit.set_pos(char, self.pos)
+            self.start_pos = self.pos
+
+def build_states(characters, moves, combos):
+    """
+    Builds a CombatantState for every combatant.
+
+    characters - {dbref: character}
+    moves - {dbref: {"move": char_move, "previous_move": prev_move}}
+    combos - {dbref: char_combo}
+
+    Returns {dbref: CombatantState}.
+    """
+    return dict((dbref, CombatantState(char, moves[dbref]["move"],
+                                       combos[dbref]))
+                for (dbref, char) in characters.items())
+
+def commit_states(states, turn_commit=None):
+    """
+    Commits every state into turn_commit. Without one, the states are
+    written straight back to their characters.
+    """
+    flush = turn_commit is None
+    if flush:
+        turn_commit = commit.CombatCommit()
+    for char_state in states.values():
+        char_state.commit(turn_commit)
+    if flush:
+        turn_commit.flush()
@@ -0,0 +1,125 @@
+"""
+Checks the breadth first battlegrounds against the recursion they
+replaced, on a grid of stub rooms.
+"""
+import unittest
+from game.gamesrc.combat import battleground
+
+# CombatHandler's ROOM_DEPTH, which the old recursion went to, and the
+# BATTLEGROUND_DEPTH it builds battlegrounds to instead
+ROOM_DEPTH = 3
+BATTLEGROUND_DEPTH = ROOM_DEPTH + 2
+GRID_SIZE = 12
+
+class StubObject(object):
+    """
+    Just enough of a room or an exit for the room graph.
+    """
+    count = 0
+
+    def __init__(self, key, location=None, destination=None):
+        StubObject.count += 1
+        self.id = StubObject.count
+        self.key = key
+        self.location = location
+        self.destination = destination
+        self.contents = []
+        if location:
+            location.contents.append(self)
+
+    def delete(self):
+        self.location.contents.remove(self)
+        self.id = None
+
+def build_grid():
+    """
+    Returns {(x, y): room} for a grid of rooms joined by cardinal exits
+    both ways, with a portal from the middle to a corner and an exit up
+    from next to the middle to the opposite corner.
+    """
+    grid = dict(((x, y), StubObject("%d,%d" % (x, y)))
+                for x in range(GRID_SIZE) for y in range(GRID_SIZE))
+    for ((x, y), room) in grid.items():
+        for (key, x_step, y_step) in (("north", 0, 1), ("south", 0, -1),
+                                      ("east", 1, 0), ("west", -1, 0)):
+            if (x + x_step, y + y_step) in grid:
+                StubObject(key, room, grid[(x + x_step, y + y_step)])
+    StubObject("portal", grid[(6, 6)], grid[(0, 0)])
+    StubObject("up", grid[(7, 6)], grid[(GRID_SIZE - 1, GRID_SIZE - 1)])
+    return grid
+
+def old_battleground(origin, depth):
+    """
+    CombatHandler.combat_state and recurse_room_state as they were,
+    except for going on to the rest of a room's exits when one isn't a
+    cardinal exit, where the recursion used to return.
+    """
+    rooms = []
+    exits = []
+    def recurse(exit, count):
+        for con in exit.destination.contents:
+            if not con.destination:
+                continue
+            if con not in exits:
+                exits.append(con)
+            if con.destination not in rooms:
+                rooms.append(con.destination)
+            if con.key not in battleground.CARDINAL_EXITS:
+                continue
+            if count > 0:
+                recurse(con, count - 1)
+    for exit in origin.contents:
+        if not exit.destination:
+            continue
+        if origin not in rooms:
+            rooms.append(origin)
+        if exit not in exits:
+            exits.append(exit)
+        recurse(exit, depth)
+    return (rooms, exits)
+
+class BattlegroundTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = build_grid()
+        self.graph = battleground.RoomGraph()
+
+    def test_matches_old_recursion(self):
+        for origin in [(6, 6), (5, 6), (7, 6), (0, 0), (3, 9)]:
+            (rooms, exits) = old_battleground(self.grid[origin], ROOM_DEPTH)
+            built = self.graph.get(self.grid[origin], BATTLEGROUND_DEPTH)
+            self.assertEqual(set(room.id for room in rooms), built.room_ids)
+            self.assertEqual(set(exit.id for exit in exits),
+                             set(exit.id for exit in built.exits))
+            self.assertEqual(len(built.rooms), len(built.room_ids))
+            self.assertTrue(built.rooms[0] is self.grid[origin])
+
+    def test_memoized(self):
+        origin = self.grid[(6, 6)]
+        built = self.graph.get(origin, BATTLEGROUND_DEPTH)
+        self.assertTrue(self.graph.get(origin, BATTLEGROUND_DEPTH) is built)
+
+    def test_deleted_exit_without_hook(self):
+        origin = self.grid[(3, 3)]
+        built = self.graph.get(origin, BATTLEGROUND_DEPTH)
+        exit = [con for con in self.grid[(3, 4)].contents
+                if con.key == "north"][0]
+        self.assertTrue(exit in built.exits)
+        exit.delete()
+        rebuilt = self.graph.get(origin, BATTLEGROUND_DEPTH)
+        self.assertFalse(rebuilt is built)
+        self.assertFalse(exit in rebuilt.exits)
+
+    def test_new_exit_after_invalidate(self):
+        origin = self.grid[(3, 3)]
+        built = self.graph.get(origin, BATTLEGROUND_DEPTH)
+        far = self.grid[(GRID_SIZE - 1, 0)]
+        exit = StubObject("down", self.grid[(3, 4)], far)
+        self.assertTrue(self.graph.get(origin, BATTLEGROUND_DEPTH) is built)
+        self.graph.invalidate(exit.location)
+        rebuilt = self.graph.get(origin, BATTLEGROUND_DEPTH)
+        self.assertTrue(exit in rebuilt.exits)
+        self.assertTrue(far.id in rebuilt.room_ids)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+"""
+Drives the CombatHandler's bookkeeping, bringing characters into a fight
+and taking them out of it, with stub characters and rooms in place of
+database objects.
+"""
+import unittest
+from game.gamesrc.combat import battleground
+from game.gamesrc.combat import registry
+from game.gamesrc.combat.scripts import combat_handler
+
+class Attributes(object):
+    """
+    Stands in for db and ndb, where anything not set is None.
+    """
+    def __getattr__(self, name):
+        return None
+
+class CmdSetHandler(object):
+
+    def __init__(self):
+        self.cmdsets = []
+
+    def add(self, cmdset):
+        self.cmdsets.append(cmdset)
+
+    def delete(self, cmdset):
+        self.cmdsets = [path for path in self.cmdsets
+                        if not path.endswith(cmdset)]
+
+class StubObject(object):
+    """
+    Just enough of a character, room or exit for the handler.
+    """
+    count = 0
+
+    def __init__(self, key, location=None, destination=None):
+        StubObject.count += 1
+        self.id = StubObject.count
+        self.key = key
+        self.location = location
+        self.destination = destination
+        self.contents = []
+        self.db = Attributes()
+        self.ndb = Attributes()
+        self.cmdset = CmdSetHandler()
+        self.has_player = True
+        self.heal_started = False
+        self.messages = []
+        if location:
+            location.contents.append(self)
+
+    def msg(self, message, prompt=None):
+        self.messages.append(message)
+
+    def msg_contents(self, message, exclude=None):
+        pass
+
+    def prompt(self):
+        return ""
+
+    def stop_bleed(self):
+        pass
+
+    def stop_heal(self):
+        self.heal_started = False
+
+    def start_bleed(self):
+        pass
+
+    def start_heal(self):
+        self.heal_started = True
+
+class StubHandler(object):
+    """
+    A CombatHandler that isn't a Script, running the handler's own
+    methods on plain attributes.
+    """
+    def __init__(self):
+        self.id = StubObject(None).id
+        self.db = Attributes()
+        self.ndb = Attributes()
+        self.stopped = False
+        self.at_script_creation()
+
+    def stop(self):
+        self.stopped = True
+
+for name in ("at_script_creation", "_init_character", "_cleanup_character",
+             "add_character", "remove_character", "msg_all", "combat_state",
+             "get_pair_graph", "_blocks", "get_waiting", "mark_waiting",
+             "mark_ready"):
+    setattr(StubHandler, name, combat_handler.CombatHandler.__dict__[name])
+
+class CombatHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.room = StubObject("arena")
+        self.next_room = StubObject("hallway")
+        self.exit = StubObject("north", self.room, self.next_room)
+        StubObject("south", self.next_room, self.room)
+        self.one = StubObject("one", self.room)
+        self.two = StubObject("two", self.room)
+        self.three = StubObject("three", self.room)
+        self.handler = StubHandler()
+        self.handler.db.origin_location = self.room
+        # as at_start does, before anyone is added
+        registry.register(self.handler)
+
+    def tearDown(self):
+        registry.unregister(self.handler)
+        battleground.ROOM_GRAPH.invalidate(self.room)
+        battleground.ROOM_GRAPH.invalidate(self.next_room)
+
+    def test_add_character(self):
+        self.handler.add_character(self.one, self.two)
+        self.handler.add_character(self.two, self.one)
+        for (character, target) in ((self.one, self.two),
+                                    (self.two, self.one)):
+            self.assertTrue(character.ndb.combat_handler is self.handler)
+            self.assertTrue(self.handler.db.pairs[character] is target)
+            self.assertTrue(registry.handler_of(character) is self.handler)
+        self.assertEqual(self.handler.get_waiting(),
+                         set([self.one.id, self.two.id]))
+
+    def test_combat_state(self):
+        self.handler.add_character(self.one, self.two)
+        self.handler.combat_state()
+        self.assertEqual(set(self.handler.db.rooms),
+                         set([self.room, self.next_room]))
+        self.assertTrue(self.exit.ndb.combat_handler is self.handler)
+        self.assertEqual(registry.handlers_in(self.next_room), [self.handler])
+
+    def test_remove_character(self):
+        for (character, target) in ((self.one, self.two),
+                                    (self.two, self.one),
+                                    (self.three, self.one)):
+            self.handler.add_character(character, target)
+        self.handler.remove_character(self.three)
+        self.assertEqual(self.three.ndb.combat_handler, None)
+        self.assertEqual(registry.handler_of(self.three), None)
+        self.assertEqual(self.three.cmdset.cmdsets, [])
+        self.assertTrue(self.three.heal_started)
+        self.assertFalse(self.handler.stopped)
+        self.handler.remove_character(self.two)
+        self.assertEqual(self.two.ndb.combat_handler, None)
+        self.assertTrue(self.handler.stopped)
+        self.assertTrue(registry.handler_of(self.one) is self.handler)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Checks outcome.OUTCOME_TABLE against the original rules in
+resolve_combat.scan_outcome, for every pair of moves, combo state and
+attacking flag.
+"""
+import unittest
+from game.gamesrc.combat import outcome
+from game.gamesrc.combat import resolve_combat
+
+class StandIn(object):
+    """
+    Just enough of a character or a combo for scan_outcome.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.ndb = self
+        self.pos = 0
+
+# a missing combo is None, as it is for anyone who isn't attacking
+COMBOS = {outcome.NO_COMBO: None,
+          outcome.COMBO: StandIn("rampage"),
+          outcome.FEINT: StandIn("feint")}
+
+class OutcomeTableTest(unittest.TestCase):
+
+    def test_table_matches_scan(self):
+        p_one = StandIn()
+        p_two = StandIn()
+        mismatches = []
+        for move_one in outcome.MOVES:
+            for move_two in outcome.MOVES:
+                for state_one in outcome.COMBO_STATES:
+                    for state_two in outcome.COMBO_STATES:
+                        for p_one_attacking in (False, True):
+                            for p_two_attacking in (False, True):
+                                combo_one = COMBOS[state_one]
+                                combo_two = COMBOS[state_two]
+                                table_winner = outcome.lookup_outcome(
+                                    move_one, combo_one, p_one_attacking,
+                                    move_two, combo_two, p_two_attacking)
+                                scan_winner = resolve_combat.scan_outcome(
+                                    p_one, move_one, combo_one,
+                                    p_one_attacking, p_two, move_two,
+                                    combo_two, p_two_attacking)
+                                if table_winner != scan_winner:
+                                    mismatches.append((move_one, move_two,
+                                        state_one, state_two,
+                                        p_one_attacking, p_two_attacking,
+                                        table_winner, scan_winner))
+        self.assertEqual(mismatches, [])
+
+    def test_both_with_missing_combo(self):
+        # thrust wins against thrust both ways, so these go through
+        # scan_outcome's same-combo check with a combo missing
+        for (combo_one, combo_two) in ((None, None),
+                                       (COMBOS[outcome.COMBO], None),
+                                       (None, COMBOS[outcome.FEINT])):
+            winner = resolve_combat.scan_outcome(StandIn(),
+                outcome.MOVES[0], combo_one, True, StandIn(),
+                outcome.MOVES[0], combo_two, True)
+            self.assertEqual(winner, "both")
+            self.assertEqual(outcome.lookup_outcome(outcome.MOVES[0],
+                combo_one, True, outcome.MOVES[0], combo_two, True),
+                "both")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Checks that a round failing in the round scheduler only fails that
+round, with stub handlers on a clock of our own.
+"""
+import unittest
+from game.gamesrc.combat import round_scheduler
+
+class NotLooping(object):
+    """
+    Stands in for the looping call, so nothing is left on the reactor.
+    """
+    running = False
+
+class Attributes(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class PairGraph(object):
+    exchanges = {}
+
+class StubHandler(object):
+    """
+    Just the phases of a round, noting the ones that are run.
+    """
+    def __init__(self, dbref, fail_in=None):
+        self.id = dbref
+        self.key = "combat_handler_%s" % dbref
+        self.db = Attributes(characters={}, turn_actions={}, turn_combos={})
+        self.fail_in = fail_in
+        self.phases = []
+
+    def _phase(self, phase):
+        if phase == self.fail_in:
+            raise ValueError("%s failed" % phase)
+        self.phases.append(phase)
+
+    def start_turn(self):
+        self._phase("start_turn")
+
+    def snapshot_modifiers(self):
+        self._phase("snapshot_modifiers")
+
+    def get_pair_graph(self):
+        self._phase("get_pair_graph")
+        return PairGraph()
+
+    def resolve_round(self, turn_commit):
+        self._phase("resolve_round")
+
+    def finish_turn(self):
+        self._phase("finish_turn")
+
+class RoundSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.scheduler = round_scheduler.RoundScheduler(
+            clock=lambda: self.now)
+        self.scheduler.looping = NotLooping()
+
+    def run_due(self, *handlers):
+        for handler in handlers:
+            self.scheduler.schedule(handler, 40, 1)
+        self.now = 1
+        self.scheduler.tick()
+
+    def test_failed_phase(self):
+        failing = StubHandler(1, "snapshot_modifiers")
+        other = StubHandler(2)
+        self.run_due(failing, other)
+        self.assertEqual(other.phases, ["start_turn", "snapshot_modifiers",
+            "get_pair_graph", "resolve_round", "finish_turn"])
+        self.assertTrue("finish_turn" in failing.phases)
+        self.assertEqual(self.scheduler.time_left(failing), 40)
+        self.assertEqual(self.scheduler.time_left(other), 40)
+
+    def test_failed_batch(self):
+        failing = StubHandler(1, "get_pair_graph")
+        other = StubHandler(2)
+        self.run_due(failing, other)
+        self.assertEqual(self.scheduler.time_left(failing), 40)
+        self.assertEqual(self.scheduler.time_left(other), 40)
+        self.now = 41
+        self.scheduler.tick()
+        self.assertEqual(other.phases.count("start_turn"), 2)
+
+if __name__ == "__main__":
+    unittest.main()
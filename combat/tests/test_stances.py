@@ -0,0 +1,109 @@
+"""
+Checks the compiled stance tables against the stance chooser they
+replaced, which worked its candidates out with list.remove on every
+call.
+"""
+import copy
+import unittest
+from game.gamesrc.combat import move
+from game.gamesrc.combat import stances
+
+# the old chooser's rules, as (tgt_move, banned_move), with the high cut
+# rule its dict literal dropped put back
+OLD_RULES = {
+    "offensive": [(move.thrust, move.riposte), (move.high_parry, move.slash),
+                  (move.low_parry, move.slash)],
+    "defensive": [(move.high_cut, move.duck), (move.low_cut, move.low_parry),
+                  (move.high_cut, move.high_parry), (move.thrust, move.dodge)]}
+
+def old_candidates(stance, previous_move, tgt_move, banned_moves):
+    """
+    The moves the old stance_chooser drew from, or None if it passed.
+    """
+    if banned_moves == "all":
+        return None
+    classic_moves = move.CLASSIC_MATRIX[:]
+    if previous_move and previous_move != move.pass_turn:
+        classic_moves.remove(previous_move)
+    if banned_moves:
+        for banned_move in banned_moves:
+            if banned_move in classic_moves:
+                classic_moves.remove(banned_move)
+        return tuple(classic_moves) or None
+    if not tgt_move:
+        tgt_move = move.pass_turn
+    if stance == "offensive":
+        classic_moves = [c_move for c_move in classic_moves
+                         if c_move.move_type != "defensive"]
+        rules = OLD_RULES["offensive"]
+    elif stance == "defensive":
+        classic_moves = [c_move for c_move in classic_moves
+                         if c_move.move_type != "offensive"]
+        rules = OLD_RULES["defensive"]
+    else:
+        rules = OLD_RULES["offensive"] + OLD_RULES["defensive"]
+    for (t_move, ban_move) in rules:
+        if t_move == tgt_move and ban_move in classic_moves:
+            classic_moves.remove(ban_move)
+    return tuple(classic_moves)
+
+class RecordingRNG(object):
+    """
+    Draws the first candidate, and remembers what it drew from.
+    """
+    def __init__(self):
+        self.drawn_from = None
+
+    def choice(self, seq):
+        self.drawn_from = tuple(seq)
+        return seq[0]
+
+PREVIOUS_MOVES = [None, move.pass_turn] + move.CLASSIC_MATRIX
+BANNED = [[], "all", [move.pass_turn], [move.thrust],
+          [move.thrust, move.dodge, move.pass_turn], move.CLASSIC_MATRIX[:]]
+
+class StanceTablesTest(unittest.TestCase):
+
+    def test_matches_old_chooser(self):
+        mismatches = []
+        for stance in ("offensive", "defensive", "balanced", "unknown"):
+            for previous_move in PREVIOUS_MOVES:
+                for tgt_move in PREVIOUS_MOVES:
+                    for banned_moves in BANNED:
+                        rng = RecordingRNG()
+                        # moves come back out of the database as copies
+                        chosen = stances.choose(rng, stance,
+                            copy.deepcopy(previous_move),
+                            copy.deepcopy(tgt_move),
+                            copy.deepcopy(banned_moves))
+                        expected = old_candidates(stance, previous_move,
+                                                  tgt_move, banned_moves)
+                        if expected is None:
+                            got = chosen is move.pass_turn and \
+                                rng.drawn_from is None
+                            if not got:
+                                mismatches.append((stance, previous_move,
+                                    tgt_move, banned_moves, chosen))
+                        elif rng.drawn_from != expected:
+                            mismatches.append((stance, previous_move,
+                                tgt_move, banned_moves, rng.drawn_from,
+                                expected))
+        self.assertEqual(mismatches, [])
+
+    def test_defensive_after_high_cut(self):
+        for stance in ("defensive", "balanced"):
+            candidates = stances.STANCE_TABLES.candidates(stance, None,
+                                                          move.high_cut, 0)
+            self.assertFalse(move.duck in candidates)
+            self.assertFalse(move.high_parry in candidates)
+
+    def test_banned_mask(self):
+        self.assertEqual(stances.banned_mask([]), 0)
+        self.assertEqual(stances.banned_mask([move.pass_turn]),
+                         stances.BANNED_OTHER)
+        self.assertEqual(stances.banned_mask([move.thrust, move.slash]),
+                         stances.MOVE_BITS["thrust"] |
+                         stances.MOVE_BITS["slash"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Level-gated combat tracing.
+
+The resolver and combat handler used to send everything they had to say
+to logger.log_infomsg, formatted up front, a few times for every
+exchange of every fight. Now they trace it:
+
+    tracing.trace("resolve", tracing.DEBUG, "p_one combo: %s", combo.name)
+
+and it only goes anywhere if the category's level lets it through.
+Nothing is formatted when it's traced. Traces go into an in-memory ring
+buffer as the format string and its arguments, and are only formatted
+when someone dumps the buffer, or when they're streamed to a file.
+Arguments are kept as they are until then, so trace values that won't
+change after the fact (names, numbers), not whole dicts.
+
+Operators can look at what combat has been up to with, eg.
+
+    @py from game.gamesrc.combat import tracing; tracing.set_level("resolve", tracing.DEBUG)
+    @py from game.gamesrc.combat import tracing; self.msg("\\n".join(tracing.dump(last=20)))
+
+Categories:
+    resolve - resolve_combat's turns and exchanges
+    damage - damage rolls
+    handler - the combat handler's turns
+    effects - status effects queued up by the handler
+    scheduler - the round scheduler's batches
+"""
+import collections
+import time
+
+# levels, from quietest to chattiest
+OFF = 0
+INFO = 1
+DEBUG = 2
+
+LEVEL_NAMES = {OFF: "off", INFO: "info", DEBUG: "debug"}
+
+# level of any category that hasn't been set
+DEFAULT_LEVEL = INFO
+# how many traces the buffer keeps
+TRACE_BUFFER_SIZE = 2000
+
+class Tracer(object):
+    """
+    Per-category levels and the ring buffer traces go into.
+
+    self.levels (dict) - {category: level}
+    self.buffer (deque) - (time, category, level, message, args) for the
+                          last TRACE_BUFFER_SIZE traces
+    self.stream - open file every trace is also written to, or None
+    """
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self.levels = {}
+        self.buffer = collections.deque(maxlen=size)
+        self.stream = None
+
+    def enabled(self, category, level):
+        """
+        Whether traces of this level in this category get recorded.
+        """
+        return level <= self.levels.get(category, DEFAULT_LEVEL)
+
+    def trace(self, category, level, message, *args):
+        """
+        Records the trace, if its category's level lets it through.
+        message is formatted with args, but not until it's read.
+        """
+        if level > self.levels.get(category, DEFAULT_LEVEL):
+            return
+        entry = (time.time(), category, level, message, args)
+        self.buffer.append(entry)
+        if self.stream:
+            self.stream.write(format_entry(entry) + "\n")
+
+    def set_level(self, category, level):
+        """
+        Sets the level of a category.
+        """
+        self.levels[category] = level
+
+    def dump(self, category=None, last=None):
+        """
+        Returns the buffered traces, oldest first, formatted as strings,
+        only of the given category if there is one, and only the last
+        ones if last is given.
+        """
+        entries = [entry for entry in self.buffer
+                   if category is None or entry[1] == category]
+        if last is not None:
+            entries = entries[-last:]
+        return [format_entry(entry) for entry in entries]
+
+    def clear(self):
+        """
+        Empties the buffer.
+        """
+        self.buffer.clear()
+
+    def stream_to(self, path):
+        """
+        Starts appending every trace from here on to the file at path.
+        """
+        self.stop_stream()
+        self.stream = open(path, "a")
+
+    def stop_stream(self):
+        """
+        Stops streaming traces to a file, if we were.
+        """
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+def format_entry(entry):
+    """
+    Formats a buffered trace as a single line.
+    """
+    (when, category, level, message, args) = entry
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError) as err:
+            message = "%s %r (%s)" % (message, args, err)
+    return "%s [%s:%s] %s" % (time.strftime("%H:%M:%S",
+                                            time.localtime(when)),
+                              category, LEVEL_NAMES.get(level, level),
+                              message)
+
+TRACER = Tracer()
+
+def trace(category, level, message, *args):
+    """
+    Traces to the shared Tracer, see Tracer.trace.
+    """
+    TRACER.trace(category, level, message, *args)
+
+def enabled(category, level):
+    """
+    See Tracer.enabled.
+    """
+    return TRACER.enabled(category, level)
+
+def set_level(category, level):
+    """
+    See Tracer.set_level.
+    """
+    TRACER.set_level(category, level)
+
+def dump(category=None, last=None):
+    """
+    See Tracer.dump.
+    """
+    return TRACER.dump(category, last)
+
+def stream_to(path):
+    """
+    See Tracer.stream_to.
+    """
+    TRACER.stream_to(path)
+
+def stop_stream():
+    """
+    See Tracer.stop_stream.
+    """
+    TRACER.stop_stream()